@@ -1,65 +1,101 @@
 import os
 from dotenv import load_dotenv
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Detect if running on Vercel
+# Detect if running on Vercel (the platform provides env vars, there is no .env file)
 IS_VERCEL = os.environ.get('VERCEL') == '1' or os.environ.get('VERCEL_ENV') is not None
 
+# Load environment variables from .env file, at most once per process
+if not IS_VERCEL and not os.environ.get('_DOTENV_LOADED'):
+    load_dotenv()
+    os.environ['_DOTENV_LOADED'] = '1'
+
+# Snapshot the environment once; plain dict lookups are cheaper than os.environ
+_ENV = dict(os.environ)
+
+# Directory containing this file (__file__ is already absolute on Python 3.9+)
+BASE_DIR = os.path.dirname(__file__)
+
+def _resolve_db_uri():
+    """Resolve the database URI once at import - use /tmp on Vercel"""
+    uri = _ENV.get('DATABASE_URI')
+    if uri:
+        return uri
+    return 'sqlite:////tmp/veterinary_sarathi.db' if IS_VERCEL else 'sqlite:///veterinary_sarathi.db'
+
 class Config:
     """Base configuration class with all settings"""
     
     # Flask Configuration
-    SECRET_KEY = os.environ.get('SECRET_KEY')
-    if not SECRET_KEY and os.environ.get('FLASK_ENV') == 'production':
+    SECRET_KEY = _ENV.get('SECRET_KEY')
+    if not SECRET_KEY and _ENV.get('FLASK_ENV') == 'production':
         raise ValueError("SECRET_KEY must be set in production environment")
     SECRET_KEY = SECRET_KEY or 'dev-secret-key-change-in-production'
     
-    FLASK_ENV = os.environ.get('FLASK_ENV') or 'development'
-    DEBUG = os.environ.get('FLASK_DEBUG', 'True') == 'True'
+    FLASK_ENV = _ENV.get('FLASK_ENV') or 'development'
+    DEBUG = _ENV.get('FLASK_DEBUG', 'True') == 'True'
+    # Templates never change on a production deploy; None follows DEBUG
+    TEMPLATES_AUTO_RELOAD = False if FLASK_ENV == 'production' else None
     
-    # Database Configuration - use /tmp on Vercel
+    # Compiled Jinja templates are cached on disk so cold starts skip re-parsing
     if IS_VERCEL:
-        SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URI') or 'sqlite:////tmp/veterinary_sarathi.db'
+        JINJA_CACHE_FOLDER = '/tmp/jinja_cache'
     else:
-        SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URI') or 'sqlite:///veterinary_sarathi.db'
+        JINJA_CACHE_FOLDER = os.path.join(BASE_DIR, '.jinja_cache')
+    
+    # Database Configuration
+    SQLALCHEMY_DATABASE_URI = _resolve_db_uri()
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
     # Upload Configuration - use /tmp on Vercel
-    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 524288000))  # 500MB default
+    # 500MB default; Vercel caps request bodies at 4.5MB, so reject larger ones before reading
+    MAX_CONTENT_LENGTH = int(_ENV.get('MAX_CONTENT_LENGTH', 4718592 if IS_VERCEL else 524288000))
+    # Chunk size used when copying uploaded files to disk
+    UPLOAD_BUFFER_SIZE = 8 * 1024 * 1024
+    # Read size for the multipart form parser (Werkzeug defaults to 64KB)
+    MULTIPART_BUFFER_SIZE = 1024 * 1024
+    # Set behind nginx/Apache to let the web server send downloads (X-Sendfile) instead of Python
+    USE_X_SENDFILE = _ENV.get('USE_X_SENDFILE', 'False') == 'True'
+    
+    # Courses shown per catalog page
+    COURSES_PER_PAGE = int(_ENV.get('COURSES_PER_PAGE', 24))
+    # Payments shown per payment history page
+    PAYMENTS_PER_PAGE = int(_ENV.get('PAYMENTS_PER_PAGE', 50))
     
     if IS_VERCEL:
         UPLOAD_FOLDER = '/tmp/uploads'
     else:
-        UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 
-                                      os.environ.get('UPLOAD_FOLDER', 'uploads'))
-    ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv', 'webm'}
-    ALLOWED_DOCUMENT_EXTENSIONS = {'pdf'}
-    ALLOWED_PRESENTATION_EXTENSIONS = {'ppt', 'pptx'}
-    ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+        UPLOAD_FOLDER = os.path.join(BASE_DIR, _ENV.get('UPLOAD_FOLDER', 'uploads'))
+    ALLOWED_VIDEO_EXTENSIONS = frozenset(('mp4', 'avi', 'mov', 'mkv', 'webm'))
+    ALLOWED_DOCUMENT_EXTENSIONS = frozenset(('pdf',))
+    ALLOWED_PRESENTATION_EXTENSIONS = frozenset(('ppt', 'pptx'))
+    ALLOWED_IMAGE_EXTENSIONS = frozenset(('png', 'jpg', 'jpeg', 'gif', 'webp'))
     
     # Admin Configuration
-    ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME', 'admin')
-    ADMIN_EMAIL = os.environ.get('ADMIN_EMAIL', 'admin@swasthikloksewa.com')
-    ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'changeme123')
+    ADMIN_USERNAME = _ENV.get('ADMIN_USERNAME', 'admin')
+    ADMIN_EMAIL = _ENV.get('ADMIN_EMAIL', 'admin@swasthikloksewa.com')
+    ADMIN_PASSWORD = _ENV.get('ADMIN_PASSWORD', 'changeme123')
     
     # eSewa Payment Gateway Configuration (Nepal)
-    ESEWA_MERCHANT_ID = os.environ.get('ESEWA_MERCHANT_ID', '')
-    ESEWA_SECRET_KEY = os.environ.get('ESEWA_SECRET_KEY', '')
-    ESEWA_SUCCESS_URL = os.environ.get('ESEWA_SUCCESS_URL', 'http://localhost:5000/payment/success')
-    ESEWA_FAILURE_URL = os.environ.get('ESEWA_FAILURE_URL', 'http://localhost:5000/payment/failure')
-    ESEWA_API_URL = os.environ.get('ESEWA_API_URL', 'https://uat.esewa.com.np/epay/main')  # Use UAT for testing
+    ESEWA_MERCHANT_ID = _ENV.get('ESEWA_MERCHANT_ID', '')
+    ESEWA_SECRET_KEY = _ENV.get('ESEWA_SECRET_KEY', '')
+    ESEWA_SUCCESS_URL = _ENV.get('ESEWA_SUCCESS_URL', 'http://localhost:5000/payment/success')
+    ESEWA_FAILURE_URL = _ENV.get('ESEWA_FAILURE_URL', 'http://localhost:5000/payment/failure')
+    ESEWA_API_URL = _ENV.get('ESEWA_API_URL', 'https://uat.esewa.com.np/epay/main')  # Use UAT for testing
+    # Server-to-server verification endpoint (e.g. https://uat.esewa.com.np/epay/transrec); unset skips verification
+    ESEWA_VERIFY_URL = _ENV.get('ESEWA_VERIFY_URL', '')
     
     # Email Configuration (for future implementation)
-    MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
-    MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
-    MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS', 'True') == 'True'
-    MAIL_USERNAME = os.environ.get('MAIL_USERNAME', '')
-    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD', '')
+    MAIL_SERVER = _ENV.get('MAIL_SERVER', 'smtp.gmail.com')
+    MAIL_PORT = int(_ENV.get('MAIL_PORT', 587))
+    MAIL_USE_TLS = _ENV.get('MAIL_USE_TLS', 'True') == 'True'
+    MAIL_USERNAME = _ENV.get('MAIL_USERNAME', '')
+    MAIL_PASSWORD = _ENV.get('MAIL_PASSWORD', '')
     
     # Session Configuration
     PERMANENT_SESSION_LIFETIME = 3600  # 1 hour in seconds
     SESSION_COOKIE_SECURE = False  # Set to True in production with HTTPS
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'Lax'
+    
+    # CSRF Configuration - tokens are bound to the session, skip per-request expiry checks
+    WTF_CSRF_TIME_LIMIT = None
@@ -2,7 +2,33 @@ from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, TextAreaField, FloatField, SelectField, FileField, IntegerField
 from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError, NumberRange
 from flask_wtf.file import FileAllowed
-import re
+import string
+
+# Usernames may only contain ASCII letters, digits and underscores;
+# translating with this table deletes those, so any leftover is invalid
+_USERNAME_STRIP = str.maketrans('', '', string.ascii_letters + string.digits + '_')
+
+# Course categories shared by CourseForm and SearchForm
+_CATEGORIES = (
+    ('general', 'General Knowledge'),
+    ('nepali', 'Nepali Language'),
+    ('english', 'English Language'),
+    ('math', 'Mathematics'),
+    ('science', 'General Science'),
+    ('constitution', 'Constitution & Law'),
+    ('computer', 'Computer Knowledge'),
+    ('current_affairs', 'Current Affairs'),
+    ('aptitude', 'Aptitude & Reasoning'),
+    ('other', 'Other'),
+)
+_CATEGORY_KEYS = frozenset(key for key, _ in _CATEGORIES)
+
+class CategorySelectField(SelectField):
+    """SelectField that checks the submitted category with a set lookup instead of scanning choices"""
+    
+    def pre_validate(self, form):
+        if self.data and self.data not in _CATEGORY_KEYS:
+            raise ValidationError(self.gettext('Not a valid choice.'))
 
 class RegistrationForm(FlaskForm):
     """Form for user registration"""
@@ -25,7 +51,7 @@ class RegistrationForm(FlaskForm):
     
     def validate_username(self, username):
         """Custom validator to ensure username contains only alphanumeric and underscore"""
-        if not re.match(r'^[a-zA-Z0-9_]+$', username.data):
+        if not username.data or username.data.translate(_USERNAME_STRIP):
             raise ValidationError('Username can only contain letters, numbers, and underscores')
 
 class LoginForm(FlaskForm):
@@ -52,18 +78,7 @@ class CourseForm(FlaskForm):
         DataRequired(),
         NumberRange(min=0, message='Price cannot be negative')
     ])
-    category = SelectField('Category', choices=[
-        ('general', 'General Knowledge'),
-        ('nepali', 'Nepali Language'),
-        ('english', 'English Language'),
-        ('math', 'Mathematics'),
-        ('science', 'General Science'),
-        ('constitution', 'Constitution & Law'),
-        ('computer', 'Computer Knowledge'),
-        ('current_affairs', 'Current Affairs'),
-        ('aptitude', 'Aptitude & Reasoning'),
-        ('other', 'Other')
-    ], validators=[DataRequired()])
+    category = CategorySelectField('Category', choices=_CATEGORIES, validators=[DataRequired()])
     thumbnail = FileField('Course Thumbnail', validators=[
         FileAllowed(['jpg', 'jpeg', 'png', 'gif', 'webp'], 'Images only!')
     ])
@@ -113,16 +128,4 @@ class SearchForm(FlaskForm):
     query = StringField('Search Course Content', validators=[
         Length(max=100, message='Search query is too long')
     ])
-    category = SelectField('Filter by Category', choices=[
-        ('', 'All Categories'),
-        ('general', 'General Knowledge'),
-        ('nepali', 'Nepali Language'),
-        ('english', 'English Language'),
-        ('math', 'Mathematics'),
-        ('science', 'General Science'),
-        ('constitution', 'Constitution & Law'),
-        ('computer', 'Computer Knowledge'),
-        ('current_affairs', 'Current Affairs'),
-        ('aptitude', 'Aptitude & Reasoning'),
-        ('other', 'Other')
-    ])
+    category = CategorySelectField('Filter by Category', choices=(('', 'All Categories'),) + _CATEGORIES)
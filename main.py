@@ -1,13 +1,100 @@
-from flask import Flask, render_template, redirect, url_for
-from flask_login import LoginManager, current_user
+from flask import Flask, Request, render_template, redirect, url_for
+from flask.logging import default_handler
+from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
-from config import Config
-from models import User, init_db
+from flask.json.provider import JSONProvider
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.formparser import FormDataParser, MultiPartParser
+from config import Config, IS_VERCEL
+from models import User, Course, init_db
+from routes.auth import auth_bp
+from routes.student import student_bp
+from routes.admin import admin_bp
+from routes.payment import payment_bp
+from routes.courses import courses_bp
 import os
+import json
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from functools import cache, lru_cache
+import orjson
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson (C extension) instead of the stdlib json module"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    def response(self, *args, **kwargs):
+        # Used by jsonify() and dict/list view returns; orjson's bytes go out as-is, no decode/re-encode
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS), mimetype='application/json'
+        )
+    
+    def loads(self, s, **kwargs):
+        # Hooks such as the session serializer's object_hook need the stdlib parser
+        if kwargs:
+            return json.loads(s, **kwargs)
+        return orjson.loads(s)
+
+class LargeBufferFormDataParser(FormDataParser):
+    """Form parser whose multipart reader pulls large chunks, so big uploads take fewer parse iterations"""
+    
+    def _parse_multipart(self, stream, mimetype, content_length, options):
+        parser = MultiPartParser(
+            stream_factory=self.stream_factory,
+            max_form_memory_size=self.max_form_memory_size,
+            max_form_parts=self.max_form_parts,
+            cls=self.cls,
+            buffer_size=Config.MULTIPART_BUFFER_SIZE,
+        )
+        boundary = options.get('boundary', '').encode('ascii')
+        
+        if not boundary:
+            raise ValueError('Missing boundary')
+        
+        form, files = parser.parse(stream, boundary, content_length)
+        return stream, form, files
+
+class UploadRequest(Request):
+    form_data_parser_class = LargeBufferFormDataParser
 
 # Initialize Flask app
 app = Flask(__name__)
 app.config.from_object(Config)
+app.json = OrjsonProvider(app)
+app.request_class = UploadRequest
+
+# Request threads only enqueue log records; a background listener thread writes them out
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s in %(module)s: %(message)s'))
+_log_queue_handler = QueueHandler(queue.SimpleQueue())
+_log_listener = None
+
+def start_log_listener():
+    """Start a listener thread draining the log queue; a forked worker needs its own, so it gets a fresh queue too"""
+    global _log_listener
+    _log_queue_handler.queue = queue.SimpleQueue()
+    _log_listener = QueueListener(_log_queue_handler.queue, _log_stream_handler)
+    _log_listener.start()
+
+start_log_listener()
+# Workers forked from a preloaded app (gunicorn --preload) inherit the queue handler but not the listener thread
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=start_log_listener)
+atexit.register(lambda: _log_listener.stop())
+app.logger.removeHandler(default_handler)
+app.logger.addHandler(_log_queue_handler)
+
+# Persist compiled templates between cold starts
+try:
+    os.makedirs(Config.JINJA_CACHE_FOLDER, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(Config.JINJA_CACHE_FOLDER)
+except OSError as e:
+    print(f"Warning: Jinja bytecode cache disabled: {e}")
 
 # Initialize CSRF protection
 csrf = CSRFProtect(app)
@@ -22,15 +109,9 @@ login_manager.login_message_category = 'info'
 @login_manager.user_loader
 def load_user(user_id):
     """Load user by ID for Flask-Login"""
-    return User.get_by_id(int(user_id))
+    return User.get_cached(int(user_id))
 
 # Register blueprints
-from routes.auth import auth_bp
-from routes.student import student_bp
-from routes.admin import admin_bp
-from routes.payment import payment_bp
-from routes.courses import courses_bp
-
 app.register_blueprint(auth_bp)
 app.register_blueprint(student_bp)
 app.register_blueprint(admin_bp)
@@ -41,8 +122,8 @@ app.register_blueprint(courses_bp)
 @app.route('/')
 def index():
     """Landing page"""
-    from models import Course
-    featured_courses = Course.get_all()[:6]  # Show first 6 courses
+    # Served from the model's catalog cache
+    featured_courses = Course.get_all(limit=6)
     return render_template('index.html', featured_courses=featured_courses)
 
 @app.route('/about')
@@ -72,29 +153,36 @@ def forbidden_error(error):
     return render_template('403.html'), 403
 
 # Create upload directories if they don't exist
+UPLOAD_SUBDIRECTORIES = ('videos', 'notes', 'presentations', 'images')
+_upload_dirs_ready = False
+
 def create_upload_directories():
     """Ensure all upload directories exist"""
+    global _upload_dirs_ready
+    if _upload_dirs_ready:
+        return
     try:
-        directories = [
-            Config.UPLOAD_FOLDER,
-            os.path.join(Config.UPLOAD_FOLDER, 'videos'),
-            os.path.join(Config.UPLOAD_FOLDER, 'notes'),
-            os.path.join(Config.UPLOAD_FOLDER, 'presentations'),
-            os.path.join(Config.UPLOAD_FOLDER, 'images')
-        ]
-        for directory in directories:
-            os.makedirs(directory, exist_ok=True)
-            # Create .gitkeep file to preserve directory structure
-            gitkeep_path = os.path.join(directory, '.gitkeep')
-            if not os.path.exists(gitkeep_path):
-                open(gitkeep_path, 'a').close()
+        if IS_VERCEL:
+            # /tmp is ephemeral; upload handlers create subdirectories on demand
+            os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
+        else:
+            for subdirectory in UPLOAD_SUBDIRECTORIES:
+                os.makedirs(os.path.join(Config.UPLOAD_FOLDER, subdirectory), exist_ok=True)
+        _upload_dirs_ready = True
         print(f"Upload directories created at: {Config.UPLOAD_FOLDER}")
     except Exception as e:
         print(f"Warning: Could not create upload directories: {e}")
         # Continue anyway - directories might be read-only on serverless
 
+# On Vercel the marker lives in /tmp next to the database, so both vanish together
+ADMIN_BOOTSTRAP_MARKER = '/tmp/.admin_bootstrapped'
+_admin_checked = False
+
 def create_admin_user():
     """Create default admin user if it doesn't exist"""
+    global _admin_checked
+    if _admin_checked or (IS_VERCEL and os.path.exists(ADMIN_BOOTSTRAP_MARKER)):
+        return
     try:
         admin = User.get_by_email(Config.ADMIN_EMAIL)
         if not admin:
@@ -105,10 +193,14 @@ def create_admin_user():
                 is_admin=True
             )
             print(f"Admin user created: {Config.ADMIN_EMAIL}")
+        _admin_checked = True
+        if IS_VERCEL:
+            open(ADMIN_BOOTSTRAP_MARKER, 'a').close()
     except Exception as e:
         print(f"Warning: Could not create admin user: {e}")
 
-# Initialize application
+# Initialize application (cached so repeated calls within a process are no-ops)
+@cache
 def initialize_app():
     """Initialize database and create necessary directories"""
     try:
@@ -120,18 +212,14 @@ def initialize_app():
     create_upload_directories()
     create_admin_user()
     print("Application initialization completed!")
+    return True
 
 # Template filters
 @app.template_filter('currency')
+@lru_cache(maxsize=256)
 def currency_filter(value):
-    """Format currency in NPR"""
-    return f"NPR {value:,.2f}"
-
-# Context processor to make certain variables available in all templates
-@app.context_processor
-def inject_user():
-    """Inject current_user into all templates"""
-    return dict(current_user=current_user)
+    """Format currency in NPR (prices repeat across listings, so results are memoized)"""
+    return 'NPR ' + format(value, ',.2f')
 
 # Initialize the app with error handling
 try:
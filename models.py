@@ -1,114 +1,356 @@
-import sqlite3
+try:
+    # Bundles a current SQLite build (newer query planner); API-compatible with the stdlib module
+    from pysqlite3 import dbapi2 as sqlite3
+except ImportError:
+    import sqlite3
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+from flask import g, has_app_context
 from flask_login import UserMixin
 import os
-
-# Detect Vercel environment
-IS_VERCEL = os.environ.get('VERCEL') == '1' or os.environ.get('VERCEL_ENV') is not None
+import queue
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from config import IS_VERCEL, BASE_DIR
 
 # Database file path - use /tmp on Vercel
 if IS_VERCEL:
     DB_PATH = '/tmp/veterinary_sarathi.db'
 else:
-    DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'veterinary_sarathi.db')
+    DB_PATH = os.path.join(BASE_DIR, 'veterinary_sarathi.db')
+
+# Bump whenever init_db changes the schema so existing databases get migrated
+SCHEMA_VERSION = 6
+
+# Hot lookups use fixed SQL strings so each pooled connection's statement cache keeps them prepared
+SQL_USER_COLUMNS = 'id, username, email, password_hash, is_admin, created_at'
+SQL_USER_BY_ID = f'SELECT {SQL_USER_COLUMNS} FROM users WHERE id = ?'
+SQL_USER_BY_EMAIL = f'SELECT {SQL_USER_COLUMNS} FROM users WHERE email = ?'
+SQL_USER_BY_USERNAME = f'SELECT {SQL_USER_COLUMNS} FROM users WHERE username = ?'
+SQL_COURSE_BY_ID = 'SELECT * FROM courses WHERE id = ?'
+SQL_IS_ENROLLED = 'SELECT 1 FROM enrollments WHERE user_id = ? AND course_id = ? LIMIT 1'
+SQL_IN_CART = 'SELECT 1 FROM cart WHERE user_id = ? AND course_id = ? LIMIT 1'
+SQL_PENDING_PAYMENTS = "SELECT id, user_id, course_id, amount FROM payments WHERE transaction_id = ? AND status = 'pending'"
+SQL_SET_STATUS_BY_TRANSACTION = 'UPDATE payments SET status = ? WHERE transaction_id = ?'
+# Columns the course listing pages render
+SQL_COURSE_CARD_COLUMNS = 'id, title, description, price, category, thumbnail, created_at'
+# Catalog queries; a NULL :category matches every category
+SQL_BROWSE_COURSES = f'''SELECT {SQL_COURSE_CARD_COLUMNS} FROM courses
+    WHERE (:category IS NULL OR category = :category)
+    ORDER BY created_at DESC, id DESC LIMIT :limit OFFSET :offset'''
+SQL_SEARCH_COURSES = f'''SELECT {SQL_COURSE_CARD_COLUMNS} FROM courses
+    JOIN (SELECT rowid, rank FROM courses_fts WHERE courses_fts MATCH :match) AS f ON f.rowid = courses.id
+    WHERE (:category IS NULL OR category = :category)
+    ORDER BY f.rank LIMIT :limit OFFSET :offset'''
+SQL_SEARCH_COURSES_LIKE = f'''SELECT {SQL_COURSE_CARD_COLUMNS} FROM courses
+    WHERE (title LIKE :term OR description LIKE :term) AND (:category IS NULL OR category = :category)
+    ORDER BY created_at DESC, id DESC LIMIT :limit OFFSET :offset'''
+
+# Plain tuples for the read-only lists templates render; cheaper than sqlite3.Row
+CourseCard = namedtuple('CourseCard', SQL_COURSE_CARD_COLUMNS.replace(',', ''))
+PaymentRecord = namedtuple(
+    'PaymentRecord',
+    'id user_id course_id amount transaction_id status payment_date username course_title'
+)
+
+# scrypt tuned to ~50ms per hash; werkzeug still verifies older pbkdf2 hashes
+PASSWORD_HASH_METHOD = 'scrypt:16384:8:1'
+
+# INSERT ... RETURNING needs SQLite 3.35+
+HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35)
+
+def _fetch_as(conn, row_type, sql, params=()):
+    """Run a query and build each row straight into `row_type`, skipping sqlite3.Row"""
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    return list(map(row_type._make, cursor.execute(sql, params)))
+
+def _insert(conn, sql, params):
+    """Run an INSERT and return the new row id, or None if no row was inserted"""
+    if HAS_RETURNING:
+        row = conn.execute(sql + ' RETURNING id', params).fetchone()
+        return row[0] if row else None
+    cursor = conn.execute(sql, params)
+    return cursor.lastrowid if cursor.rowcount else None
+
+def _delete_returning(conn, sql, params, columns):
+    """Run a DELETE and return the listed columns of the rows it removed"""
+    if HAS_RETURNING:
+        return conn.execute(f'{sql} RETURNING {columns}', params).fetchall()
+    # Older SQLite: read the same rows first (callers run this inside a transaction)
+    rows = conn.execute(sql.replace('DELETE FROM', f'SELECT {columns} FROM', 1), params).fetchall()
+    conn.execute(sql, params)
+    return rows
+
+class _TTLCache:
+    """Tiny in-process cache whose entries expire after `ttl` seconds"""
+    
+    def __init__(self, ttl, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = {}
+    
+    def get(self, key):
+        """Return the cached value, or None if missing or expired"""
+        entry = self._data.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+    
+    def set(self, key, value):
+        if len(self._data) >= self.maxsize:
+            self._data.clear()
+        self._data[key] = (time.monotonic() + self.ttl, value)
+    
+    def pop(self, key):
+        self._data.pop(key, None)
+    
+    def clear(self):
+        self._data.clear()
+
+# Users loaded for Flask-Login and course rows are reused for a short while
+_user_cache = _TTLCache(ttl=30)
+_course_cache = _TTLCache(ttl=60)
+# Course listings, keyed by query; any course write clears the whole thing
+_catalog_cache = _TTLCache(ttl=60)
+# Search results, kept apart so one-off queries can't evict the browse pages
+_search_cache = _TTLCache(ttl=30)
 
 def get_db_connection():
     """Create and return a database connection"""
-    conn = sqlite3.connect(DB_PATH)
+    # Room in the per-connection statement cache for every fixed query the app runs
+    conn = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    # Per-connection tuning; journal_mode=WAL is persistent and set once in init_db()
+    if IS_VERCEL:
+        # /tmp is ephemeral on Vercel, so keep the rollback journal in memory instead of WAL files
+        conn.execute('PRAGMA journal_mode=MEMORY')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-64000')
+    # Read pages straight from a memory map of the file instead of copying them through read()
+    conn.execute('PRAGMA mmap_size=134217728')
+    conn.execute('PRAGMA busy_timeout=5000')
     return conn
 
+# Pooled connections are reused across requests so the page cache and statement cache stay warm
+POOL_SIZE = 8
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+_pool_pid = os.getpid()
+
+@contextmanager
+def borrow():
+    """Borrow a pooled database connection for the duration of a with-block"""
+    global _pool, _pool_pid
+    if _pool_pid != os.getpid():
+        # SQLite connections must not be shared across a fork; start a fresh pool in the child
+        _pool = queue.LifoQueue(maxsize=POOL_SIZE)
+        _pool_pid = os.getpid()
+    pool = _pool
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+@contextmanager
+def transaction():
+    """Run a with-block as one write transaction on a pooled connection"""
+    with borrow() as conn:
+        # IMMEDIATE takes the write lock up front so the block can't fail midway on SQLITE_BUSY
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+@contextmanager
+def _connection(conn=None):
+    """Use the caller's connection (e.g. inside transaction()) or borrow one"""
+    if conn is not None:
+        yield conn
+    else:
+        with borrow() as conn:
+            yield conn
+
 def init_db():
     """Initialize the database with all required tables"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            is_admin INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Courses table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS courses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            description TEXT,
-            price REAL NOT NULL,
-            category TEXT,
-            thumbnail TEXT,
-            instructor_id INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (instructor_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Content table (videos, PDFs, presentations)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS content (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            course_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            content_type TEXT NOT NULL,
-            file_path TEXT NOT NULL,
-            display_order INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (course_id) REFERENCES courses (id) ON DELETE CASCADE
-        )
-    ''')
-    
-    # Enrollments table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS enrollments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            course_id INTEGER NOT NULL,
-            enrolled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            progress REAL DEFAULT 0.0,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (course_id) REFERENCES courses (id),
-            UNIQUE(user_id, course_id)
-        )
-    ''')
-    
-    # Payments table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS payments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            course_id INTEGER NOT NULL,
-            amount REAL NOT NULL,
-            transaction_id TEXT UNIQUE,
-            status TEXT DEFAULT 'pending',
-            payment_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (course_id) REFERENCES courses (id)
-        )
-    ''')
-    
-    # Cart table for shopping cart functionality
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS cart (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            course_id INTEGER NOT NULL,
-            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (course_id) REFERENCES courses (id),
-            UNIQUE(user_id, course_id)
-        )
-    ''')
+    with borrow() as conn:
+        # Schema already at this version (e.g. a warm /tmp on Vercel): nothing to do
+        if conn.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION:
+            return
+        if not IS_VERCEL:
+            # WAL lets readers proceed while a write is in progress; the setting persists in the file
+            conn.execute('PRAGMA journal_mode=WAL')
+        cursor = conn.cursor()
     
-    conn.commit()
-    conn.close()
+        # Users table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                email TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                is_admin INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+    
+        # Courses table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS courses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                description TEXT,
+                price REAL NOT NULL,
+                category TEXT,
+                thumbnail TEXT,
+                instructor_id INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (instructor_id) REFERENCES users (id)
+            )
+        ''')
+    
+        # Content table (videos, PDFs, presentations)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS content (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                course_id INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                content_type TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                display_order INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (course_id) REFERENCES courses (id) ON DELETE CASCADE
+            )
+        ''')
+    
+        # Enrollments table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS enrollments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                course_id INTEGER NOT NULL,
+                enrolled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                progress REAL DEFAULT 0.0,
+                FOREIGN KEY (user_id) REFERENCES users (id),
+                FOREIGN KEY (course_id) REFERENCES courses (id),
+                UNIQUE(user_id, course_id)
+            )
+        ''')
+    
+        # Payments table; a cart checkout records one row per course under a shared transaction_id
+        payments_columns = '''
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                course_id INTEGER NOT NULL,
+                amount REAL NOT NULL,
+                transaction_id TEXT,
+                status TEXT DEFAULT 'pending',
+                payment_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id),
+                FOREIGN KEY (course_id) REFERENCES courses (id)
+        '''
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS payments ({payments_columns})')
+        
+        # Migration: payments created with a UNIQUE transaction_id rejected multi-course checkouts.
+        # SQLite can't drop a constraint, so copy the rows into a rebuilt table.
+        payments_sql = cursor.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'payments'"
+        ).fetchone()[0]
+        if 'transaction_id TEXT UNIQUE' in payments_sql:
+            cursor.executescript(f'''
+                BEGIN;
+                CREATE TABLE payments_rebuilt ({payments_columns});
+                INSERT INTO payments_rebuilt (id, user_id, course_id, amount, transaction_id, status, payment_date)
+                    SELECT id, user_id, course_id, amount, transaction_id, status, payment_date FROM payments;
+                DROP TABLE payments;
+                ALTER TABLE payments_rebuilt RENAME TO payments;
+                COMMIT;
+            ''')
+    
+        # Cart table for shopping cart functionality
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cart (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                course_id INTEGER NOT NULL,
+                price_at_add REAL,
+                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id),
+                FOREIGN KEY (course_id) REFERENCES courses (id),
+                UNIQUE(user_id, course_id)
+            )
+        ''')
+    
+        # Migration: carts created before price_at_add existed get the column and current prices
+        cart_columns = [row['name'] for row in cursor.execute('PRAGMA table_info(cart)')]
+        if 'price_at_add' not in cart_columns:
+            cursor.execute('ALTER TABLE cart ADD COLUMN price_at_add REAL')
+            cursor.execute('UPDATE cart SET price_at_add = (SELECT price FROM courses WHERE id = cart.course_id)')
+    
+        # Indexes for hot WHERE/JOIN columns. enrollments/cart (user_id, course_id) are
+        # already covered by their UNIQUE constraints.
+        # Payment callbacks look rows up by transaction_id, payment_success also by status; carrying
+        # user_id/course_id makes SQL_PENDING_PAYMENTS an index-only scan (id is the rowid)
+        cursor.execute('DROP INDEX IF EXISTS idx_payments_transaction')
+        cursor.execute('DROP INDEX IF EXISTS idx_payments_txn_status')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_payments_txn_lookup ON payments (transaction_id, status, user_id, course_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_enrollments_course ON enrollments (course_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_payments_user ON payments (user_id)')
+        cursor.execute('DROP INDEX IF EXISTS idx_payments_status_amount')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_payments_success_amount ON payments (amount) WHERE status = 'success'")
+        # Cart totals are summed from the fetched rows now, so this index only slowed cart writes
+        cursor.execute('DROP INDEX IF EXISTS idx_cart_user_price')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_content_course_order ON content (course_id, display_order)')
+        # Per-course revenue reads successful payments straight off this covering partial index
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_payments_success_course ON payments (course_id, amount) WHERE status = 'success'")
+        # Newest-first payment lists (analytics, history, CSV export)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_payments_date ON payments (payment_date DESC)')
+    
+        # Full-text index over course title/description, kept in sync by triggers.
+        # Skipped when this SQLite build lacks FTS5; Course.filter then falls back to LIKE.
+        try:
+            fts_exists = cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'courses_fts'"
+            ).fetchone()
+            cursor.executescript('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS courses_fts USING fts5(
+                    title, description, content='courses', content_rowid='id'
+                );
+                CREATE TRIGGER IF NOT EXISTS courses_fts_insert AFTER INSERT ON courses BEGIN
+                    INSERT INTO courses_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+                END;
+                CREATE TRIGGER IF NOT EXISTS courses_fts_delete AFTER DELETE ON courses BEGIN
+                    INSERT INTO courses_fts (courses_fts, rowid, title, description)
+                    VALUES ('delete', old.id, old.title, old.description);
+                END;
+                CREATE TRIGGER IF NOT EXISTS courses_fts_update AFTER UPDATE OF title, description ON courses BEGIN
+                    INSERT INTO courses_fts (courses_fts, rowid, title, description)
+                    VALUES ('delete', old.id, old.title, old.description);
+                    INSERT INTO courses_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+                END;
+            ''')
+            if not fts_exists:
+                # Index courses created before the FTS table existed
+                cursor.execute("INSERT INTO courses_fts (courses_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError:
+            pass
+    
+        # Refresh planner statistics for the new indexes
+        cursor.execute('ANALYZE')
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
 
 class User(UserMixin):
     """User model for authentication and user management"""
@@ -121,98 +363,117 @@ class User(UserMixin):
         self.is_admin = is_admin
         self.created_at = created_at
     
+    @classmethod
+    def _from_row(cls, row):
+        """Build a User from a row selected with SQL_USER_COLUMNS"""
+        return cls(*row)
+    
     @staticmethod
     def create(username, email, password, is_admin=False):
         """Create a new user"""
-        conn = get_db_connection()
-        password_hash = generate_password_hash(password, method='pbkdf2:sha256')
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                'INSERT INTO users (username, email, password_hash, is_admin) VALUES (?, ?, ?, ?)',
+        password_hash = User.hash_password(password)
+        with borrow() as conn:
+            # Taken username/email: no row is inserted and _insert returns None
+            return _insert(
+                conn,
+                'INSERT INTO users (username, email, password_hash, is_admin) VALUES (?, ?, ?, ?) ON CONFLICT DO NOTHING',
                 (username, email, password_hash, 1 if is_admin else 0)
             )
-            conn.commit()
-            user_id = cursor.lastrowid
-            conn.close()
-            return user_id
-        except sqlite3.IntegrityError:
-            conn.close()
-            return None
+    
+    @staticmethod
+    def find_taken(username, email, exclude_id=None):
+        """Check which of a username/email pair is already registered (to someone other
+        than `exclude_id`), as (email_taken, username_taken)"""
+        with borrow() as conn:
+            # id IS NOT NULL matches every row when there is no user to exclude
+            row = conn.execute(
+                'SELECT MAX(email = ?), MAX(username = ?) FROM users WHERE (email = ? OR username = ?) AND id IS NOT ?',
+                (email, username, email, username, exclude_id)
+            ).fetchone()
+        return bool(row[0]), bool(row[1])
+    
+    @staticmethod
+    def update_profile(user_id, username, email):
+        """Change a user's username and email; returns False if either belongs to another user"""
+        with borrow() as conn:
+            # OR IGNORE turns a UNIQUE clash into "no row updated" instead of an exception
+            updated = conn.execute(
+                'UPDATE OR IGNORE users SET username = ?, email = ? WHERE id = ?',
+                (username, email, user_id)
+            ).rowcount
+        User.invalidate_cache(user_id)
+        return updated > 0
     
     @staticmethod
     def get_by_id(user_id):
         """Get user by ID"""
-        conn = get_db_connection()
-        user_data = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
-        conn.close()
-        
-        if user_data:
-            return User(
-                id=user_data['id'],
-                username=user_data['username'],
-                email=user_data['email'],
-                password_hash=user_data['password_hash'],
-                is_admin=user_data['is_admin'],
-                created_at=user_data['created_at']
-            )
-        return None
+        with borrow() as conn:
+            user_data = conn.execute(SQL_USER_BY_ID, (user_id,)).fetchone()
+        return User._from_row(user_data) if user_data else None
     
     @staticmethod
     def get_by_email(email):
         """Get user by email"""
-        conn = get_db_connection()
-        user_data = conn.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
-        conn.close()
-        
-        if user_data:
-            return User(
-                id=user_data['id'],
-                username=user_data['username'],
-                email=user_data['email'],
-                password_hash=user_data['password_hash'],
-                is_admin=user_data['is_admin'],
-                created_at=user_data['created_at']
-            )
-        return None
+        with borrow() as conn:
+            user_data = conn.execute(SQL_USER_BY_EMAIL, (email,)).fetchone()
+        return User._from_row(user_data) if user_data else None
     
     @staticmethod
     def get_by_username(username):
         """Get user by username"""
-        conn = get_db_connection()
-        user_data = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
-        conn.close()
-        
-        if user_data:
-            return User(
-                id=user_data['id'],
-                username=user_data['username'],
-                email=user_data['email'],
-                password_hash=user_data['password_hash'],
-                is_admin=user_data['is_admin'],
-                created_at=user_data['created_at']
-            )
-        return None
+        with borrow() as conn:
+            user_data = conn.execute(SQL_USER_BY_USERNAME, (username,)).fetchone()
+        return User._from_row(user_data) if user_data else None
+    
+    @staticmethod
+    def get_cached(user_id):
+        """Get user by ID, served from a short-lived cache when possible"""
+        user = _user_cache.get(user_id)
+        if user is None:
+            user = User.get_by_id(user_id)
+            if user:
+                _user_cache.set(user_id, user)
+        return user
+    
+    @staticmethod
+    def invalidate_cache(user_id):
+        """Drop a cached user after their row has changed"""
+        _user_cache.pop(user_id)
     
     def check_password(self, password):
         """Check if provided password matches the hash"""
         return check_password_hash(self.password_hash, password)
     
+    def needs_rehash(self):
+        """Check if the stored hash was made with an older method"""
+        return not self.password_hash.startswith(PASSWORD_HASH_METHOD + '$')
+    
     @staticmethod
-    def get_all_students():
-        """Get all non-admin users"""
-        conn = get_db_connection()
-        students = conn.execute('SELECT * FROM users WHERE is_admin = 0 ORDER BY created_at DESC').fetchall()
-        conn.close()
-        return students
+    def hash_password(password):
+        """Hash a password with the current method"""
+        return generate_password_hash(password, method=PASSWORD_HASH_METHOD)
     
     @staticmethod
-    def get_student_count():
-        """Get total number of students"""
-        conn = get_db_connection()
-        count = conn.execute('SELECT COUNT(*) FROM users WHERE is_admin = 0').fetchone()[0]
-        conn.close()
-        return count
+    def set_password(user_id, password):
+        """Store a new password hash for a user"""
+        password_hash = User.hash_password(password)
+        with borrow() as conn:
+            conn.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
+        User.invalidate_cache(user_id)
+    
+    @staticmethod
+    def get_students_with_enrollment_counts():
+        """Get all non-admin users, each with an enrollment_count column"""
+        with borrow() as conn:
+            # enrollments' UNIQUE (user_id, course_id) index serves the join
+            return conn.execute(
+                '''SELECT u.id, u.username, u.email, u.created_at, COUNT(e.id) AS enrollment_count
+                   FROM users u
+                   LEFT JOIN enrollments e ON e.user_id = u.id
+                   WHERE u.is_admin = 0
+                   GROUP BY u.id
+                   ORDER BY u.created_at DESC'''
+            ).fetchall()
 
 class Course:
     """Course model for managing courses"""
@@ -220,76 +481,110 @@ class Course:
     @staticmethod
     def create(title, description, price, category, thumbnail=None, instructor_id=None):
         """Create a new course"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            'INSERT INTO courses (title, description, price, category, thumbnail, instructor_id) VALUES (?, ?, ?, ?, ?, ?)',
-            (title, description, price, category, thumbnail, instructor_id)
-        )
-        conn.commit()
-        course_id = cursor.lastrowid
-        conn.close()
+        with borrow() as conn:
+            course_id = _insert(
+                conn,
+                'INSERT INTO courses (title, description, price, category, thumbnail, instructor_id) VALUES (?, ?, ?, ?, ?, ?)',
+                (title, description, price, category, thumbnail, instructor_id)
+            )
+        _catalog_cache.clear()
+        _search_cache.clear()
         return course_id
     
     @staticmethod
-    def get_by_id(course_id):
-        """Get course by ID"""
-        conn = get_db_connection()
-        course = conn.execute('SELECT * FROM courses WHERE id = ?', (course_id,)).fetchone()
-        conn.close()
+    def get_by_id(course_id, conn=None):
+        """Get course by ID (cached briefly; admin edits invalidate the entry)"""
+        course = _course_cache.get(course_id)
+        if course is None:
+            with _connection(conn) as conn:
+                course = conn.execute(SQL_COURSE_BY_ID, (course_id,)).fetchone()
+            if course:
+                _course_cache.set(course_id, course)
         return course
     
     @staticmethod
-    def get_all():
-        """Get all courses"""
-        conn = get_db_connection()
-        courses = conn.execute('SELECT * FROM courses ORDER BY created_at DESC').fetchall()
-        conn.close()
-        return courses
+    def get_all(limit=None):
+        """Get all courses, newest first (optionally only the first `limit`); cached briefly"""
+        return Course.filter(limit=limit)
     
     @staticmethod
-    def get_by_category(category):
-        """Get courses by category"""
-        conn = get_db_connection()
-        courses = conn.execute('SELECT * FROM courses WHERE category = ? ORDER BY created_at DESC', (category,)).fetchall()
-        conn.close()
-        return courses
+    def get_id_title_pairs():
+        """Get (id, title) tuples for course pickers, ordered by title; cached briefly"""
+        key = ('id_title',)
+        pairs = _catalog_cache.get(key)
+        if pairs is None:
+            with borrow() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = None
+                pairs = cursor.execute('SELECT id, title FROM courses ORDER BY title').fetchall()
+            _catalog_cache.set(key, pairs)
+        return pairs
     
     @staticmethod
     def update(course_id, title, description, price, category, thumbnail=None):
         """Update course details"""
-        conn = get_db_connection()
-        if thumbnail:
-            conn.execute(
-                'UPDATE courses SET title = ?, description = ?, price = ?, category = ?, thumbnail = ? WHERE id = ?',
-                (title, description, price, category, thumbnail, course_id)
-            )
-        else:
+        with borrow() as conn:
+            # A missing thumbnail keeps the current one
             conn.execute(
-                'UPDATE courses SET title = ?, description = ?, price = ?, category = ? WHERE id = ?',
-                (title, description, price, category, course_id)
+                'UPDATE courses SET title = ?, description = ?, price = ?, category = ?, thumbnail = COALESCE(?, thumbnail) WHERE id = ?',
+                (title, description, price, category, thumbnail or None, course_id)
             )
-        conn.commit()
-        conn.close()
+            # Keep cart totals in line with the price shown and charged
+            conn.execute('UPDATE cart SET price_at_add = ? WHERE course_id = ?', (price, course_id))
+        _course_cache.pop(course_id)
+        _catalog_cache.clear()
+        _search_cache.clear()
     
     @staticmethod
     def delete(course_id):
-        """Delete a course"""
-        conn = get_db_connection()
-        conn.execute('DELETE FROM courses WHERE id = ?', (course_id,))
-        conn.commit()
-        conn.close()
-    
-    @staticmethod
-    def search(query):
-        """Search courses by title or description"""
-        conn = get_db_connection()
-        search_term = f'%{query}%'
-        courses = conn.execute(
-            'SELECT * FROM courses WHERE title LIKE ? OR description LIKE ? ORDER BY created_at DESC',
-            (search_term, search_term)
-        ).fetchall()
-        conn.close()
+        """Delete a course and its content rows.
+        
+        Returns the deleted content's file paths, or None if there was no such course.
+        """
+        with transaction() as conn:
+            if not _delete_returning(conn, 'DELETE FROM courses WHERE id = ?', (course_id,), 'id'):
+                return None
+            contents = _delete_returning(conn, 'DELETE FROM content WHERE course_id = ?', (course_id,), 'file_path')
+        _course_cache.pop(course_id)
+        _catalog_cache.clear()
+        _search_cache.clear()
+        return [row['file_path'] for row in contents]
+    
+    @staticmethod
+    def filter(query=None, category=None, limit=None, offset=None):
+        """Get courses matching an optional search query and/or category, one page at a time.
+        
+        Browsing (no query) is newest first, searches are ordered by relevance; both are cached briefly.
+        """
+        params = {
+            'category': category or None,
+            # LIMIT -1 means no limit in SQLite
+            'limit': -1 if limit is None else limit,
+            'offset': offset or 0,
+        }
+        query = (query or '').strip()
+        if not query:
+            key = ('filter', params['category'], params['limit'], params['offset'])
+            courses = _catalog_cache.get(key)
+            if courses is None:
+                with borrow() as conn:
+                    courses = _fetch_as(conn, CourseCard, SQL_BROWSE_COURSES, params)
+                _catalog_cache.set(key, courses)
+            return courses
+        
+        # Quote each word so user input can't inject FTS syntax, and match it as a prefix
+        key = (query, params['category'], params['limit'], params['offset'])
+        courses = _search_cache.get(key)
+        if courses is None:
+            params['match'] = ' '.join('"' + word.replace('"', '""') + '"*' for word in query.split())
+            params['term'] = f'%{query}%'
+            with borrow() as conn:
+                try:
+                    courses = _fetch_as(conn, CourseCard, SQL_SEARCH_COURSES, params)
+                except sqlite3.OperationalError:
+                    # No FTS5 in this SQLite build
+                    courses = _fetch_as(conn, CourseCard, SQL_SEARCH_COURSES_LIKE, params)
+            _search_cache.set(key, courses)
         return courses
 
 class Content:
@@ -298,125 +593,161 @@ class Content:
     @staticmethod
     def create(course_id, title, content_type, file_path, display_order=0):
         """Create new content"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
+        with borrow() as conn:
+            return _insert(
+                conn,
+                'INSERT INTO content (course_id, title, content_type, file_path, display_order) VALUES (?, ?, ?, ?, ?)',
+                (course_id, title, content_type, file_path, display_order)
+            )
+    
+    @staticmethod
+    def create_many(course_id, items, conn=None):
+        """Create several content rows in one transaction; items are (title, content_type, file_path, display_order)"""
+        if conn is None:
+            with transaction() as conn:
+                return Content.create_many(course_id, items, conn)
+        return conn.executemany(
             'INSERT INTO content (course_id, title, content_type, file_path, display_order) VALUES (?, ?, ?, ?, ?)',
-            (course_id, title, content_type, file_path, display_order)
-        )
-        conn.commit()
-        content_id = cursor.lastrowid
-        conn.close()
-        return content_id
+            [(course_id, *item) for item in items]
+        ).rowcount
     
     @staticmethod
-    def get_by_course(course_id):
+    def get_by_course(course_id, conn=None):
         """Get all content for a specific course"""
-        conn = get_db_connection()
-        contents = conn.execute(
-            'SELECT * FROM content WHERE course_id = ? ORDER BY display_order, created_at',
-            (course_id,)
-        ).fetchall()
-        conn.close()
-        return contents
+        with _connection(conn) as conn:
+            return conn.execute(
+                'SELECT * FROM content WHERE course_id = ? ORDER BY display_order, created_at',
+                (course_id,)
+            ).fetchall()
+    
+    @staticmethod
+    def get_by_course_json(course_id):
+        """Get a course's content list as a JSON array string built by SQLite"""
+        with borrow() as conn:
+            # The ordered subquery fixes the order json_group_array sees the rows in
+            return conn.execute(
+                '''SELECT json_group_array(json_object(
+                          'id', id, 'title', title, 'content_type', content_type,
+                          'file_path', file_path, 'display_order', display_order))
+                   FROM (SELECT * FROM content WHERE course_id = ? ORDER BY display_order, created_at)''',
+                (course_id,)
+            ).fetchone()[0]
     
     @staticmethod
     def get_by_id(content_id):
         """Get content by ID"""
-        conn = get_db_connection()
-        content = conn.execute('SELECT * FROM content WHERE id = ?', (content_id,)).fetchone()
-        conn.close()
-        return content
+        with borrow() as conn:
+            return conn.execute('SELECT * FROM content WHERE id = ?', (content_id,)).fetchone()
     
     @staticmethod
     def delete(content_id):
-        """Delete content"""
-        conn = get_db_connection()
-        conn.execute('DELETE FROM content WHERE id = ?', (content_id,))
-        conn.commit()
-        conn.close()
+        """Delete content; returns the deleted row's course_id and file_path, or None if not found"""
+        with transaction() as conn:
+            rows = _delete_returning(conn, 'DELETE FROM content WHERE id = ?', (content_id,), 'course_id, file_path')
+        return rows[0] if rows else None
+    
+    @staticmethod
+    def unreferenced(file_paths):
+        """Return the given file paths that no content row points at"""
+        if not file_paths:
+            return []
+        with borrow() as conn:
+            placeholders = ', '.join('?' * len(file_paths))
+            used = {row[0] for row in conn.execute(
+                f'SELECT file_path FROM content WHERE file_path IN ({placeholders})', list(file_paths)
+            )}
+        return [path for path in dict.fromkeys(file_paths) if path not in used]
+
+def _forget_enrollments():
+    """Drop the current request's remembered is_enrolled() answers"""
+    if has_app_context():
+        g.pop('_enrollment_cache', None)
 
 class Enrollment:
     """Enrollment model for managing student enrollments"""
     
     @staticmethod
-    def create(user_id, course_id):
-        """Enroll a user in a course"""
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                'INSERT INTO enrollments (user_id, course_id) VALUES (?, ?)',
-                (user_id, course_id)
-            )
-            conn.commit()
-            enrollment_id = cursor.lastrowid
-            conn.close()
-            return enrollment_id
-        except sqlite3.IntegrityError:
-            conn.close()
-            return None
+    def create_many(enrollments, conn=None):
+        """Create (user_id, course_id) enrollments in one transaction, skipping existing ones"""
+        _forget_enrollments()
+        if conn is None:
+            with transaction() as conn:
+                return Enrollment.create_many(enrollments, conn)
+        return conn.executemany(
+            'INSERT INTO enrollments (user_id, course_id) VALUES (?, ?) ON CONFLICT (user_id, course_id) DO NOTHING',
+            enrollments
+        ).rowcount
     
     @staticmethod
     def get_by_user(user_id):
-        """Get all enrollments for a user"""
-        conn = get_db_connection()
-        enrollments = conn.execute(
-            '''SELECT e.*, c.title, c.description, c.thumbnail, c.category
-               FROM enrollments e
-               JOIN courses c ON e.course_id = c.id
-               WHERE e.user_id = ?
-               ORDER BY e.enrolled_at DESC''',
-            (user_id,)
-        ).fetchall()
-        conn.close()
-        return enrollments
+        """Get all enrollments for a user, with each course's content count"""
+        with borrow() as conn:
+            return conn.execute(
+                '''SELECT e.*, c.title, c.description, c.thumbnail, c.category,
+                          (SELECT COUNT(*) FROM content WHERE course_id = e.course_id) AS total_content
+                   FROM enrollments e
+                   JOIN courses c ON e.course_id = c.id
+                   WHERE e.user_id = ?
+                   ORDER BY e.enrolled_at DESC''',
+                (user_id,)
+            ).fetchall()
     
     @staticmethod
     def is_enrolled(user_id, course_id):
-        """Check if user is enrolled in a course"""
-        conn = get_db_connection()
-        enrollment = conn.execute(
-            'SELECT * FROM enrollments WHERE user_id = ? AND course_id = ?',
-            (user_id, course_id)
-        ).fetchone()
-        conn.close()
-        return enrollment is not None
+        """Check if user is enrolled in a course; answers are remembered for the current request"""
+        cache = g.setdefault('_enrollment_cache', {}) if has_app_context() else {}
+        key = (user_id, course_id)
+        if key not in cache:
+            with borrow() as conn:
+                cache[key] = conn.execute(SQL_IS_ENROLLED, key).fetchone() is not None
+        return cache[key]
+    
+    @staticmethod
+    def get_enrolled_course_ids(user_id, course_ids, conn=None):
+        """Return the subset of `course_ids` the user is already enrolled in, as a set"""
+        course_ids = list(course_ids)
+        if not course_ids:
+            return set()
+        placeholders = ', '.join('?' * len(course_ids))
+        with _connection(conn) as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            return {row[0] for row in cursor.execute(
+                f'SELECT course_id FROM enrollments WHERE user_id = ? AND course_id IN ({placeholders})',
+                (user_id, *course_ids)
+            )}
+    
+    @staticmethod
+    def get(user_id, course_id, conn=None):
+        """Get a user's enrollment in a course, or None if not enrolled"""
+        with _connection(conn) as conn:
+            return conn.execute(
+                'SELECT * FROM enrollments WHERE user_id = ? AND course_id = ?',
+                (user_id, course_id)
+            ).fetchone()
     
     @staticmethod
     def update_progress(user_id, course_id, progress):
         """Update course progress for a user"""
-        conn = get_db_connection()
-        conn.execute(
-            'UPDATE enrollments SET progress = ? WHERE user_id = ? AND course_id = ?',
-            (progress, user_id, course_id)
-        )
-        conn.commit()
-        conn.close()
-    
-    @staticmethod
-    def get_enrollment_count():
-        """Get total number of enrollments"""
-        conn = get_db_connection()
-        count = conn.execute('SELECT COUNT(*) FROM enrollments').fetchone()[0]
-        conn.close()
-        return count
+        with borrow() as conn:
+            conn.execute(
+                'UPDATE enrollments SET progress = ? WHERE user_id = ? AND course_id = ?',
+                (progress, user_id, course_id)
+            )
     
     @staticmethod
     def get_recent_enrollments(limit=10):
         """Get recent enrollments"""
-        conn = get_db_connection()
-        enrollments = conn.execute(
-            '''SELECT e.*, u.username, c.title as course_title
-               FROM enrollments e
-               JOIN users u ON e.user_id = u.id
-               JOIN courses c ON e.course_id = c.id
-               ORDER BY e.enrolled_at DESC
-               LIMIT ?''',
-            (limit,)
-        ).fetchall()
-        conn.close()
-        return enrollments
+        with borrow() as conn:
+            return conn.execute(
+                '''SELECT e.*, u.username, c.title as course_title
+                   FROM enrollments e
+                   JOIN users u ON e.user_id = u.id
+                   JOIN courses c ON e.course_id = c.id
+                   ORDER BY e.enrolled_at DESC
+                   LIMIT ?''',
+                (limit,)
+            ).fetchall()
 
 class Payment:
     """Payment model for managing transactions"""
@@ -424,78 +755,96 @@ class Payment:
     @staticmethod
     def create(user_id, course_id, amount, transaction_id=None, status='pending'):
         """Create a new payment record"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
+        with borrow() as conn:
+            return _insert(
+                conn,
+                'INSERT INTO payments (user_id, course_id, amount, transaction_id, status) VALUES (?, ?, ?, ?, ?)',
+                (user_id, course_id, amount, transaction_id, status)
+            )
+    
+    @staticmethod
+    def create_many(payments, conn=None):
+        """Create payment records from (user_id, course_id, amount, transaction_id, status) rows in one transaction"""
+        if conn is None:
+            with transaction() as conn:
+                return Payment.create_many(payments, conn)
+        return conn.executemany(
             'INSERT INTO payments (user_id, course_id, amount, transaction_id, status) VALUES (?, ?, ?, ?, ?)',
-            (user_id, course_id, amount, transaction_id, status)
+            payments
+        ).rowcount
+    
+    @staticmethod
+    def update_status_many(payment_ids, status, transaction_id=None, conn=None):
+        """Update the status of several payments in one transaction"""
+        if conn is None:
+            with transaction() as conn:
+                return Payment.update_status_many(payment_ids, status, transaction_id, conn)
+        conn.executemany(
+            'UPDATE payments SET status = ?, transaction_id = COALESCE(?, transaction_id) WHERE id = ?',
+            [(status, transaction_id or None, payment_id) for payment_id in payment_ids]
         )
-        conn.commit()
-        payment_id = cursor.lastrowid
-        conn.close()
-        return payment_id
     
     @staticmethod
-    def update_status(payment_id, status, transaction_id=None):
-        """Update payment status"""
-        conn = get_db_connection()
-        if transaction_id:
-            conn.execute(
-                'UPDATE payments SET status = ?, transaction_id = ? WHERE id = ?',
-                (status, transaction_id, payment_id)
-            )
-        else:
-            conn.execute(
-                'UPDATE payments SET status = ? WHERE id = ?',
-                (status, payment_id)
-            )
-        conn.commit()
-        conn.close()
+    def get_pending_by_transaction(transaction_id, conn=None):
+        """Get the pending payments (id, user_id, course_id, amount) recorded under a gateway transaction id"""
+        with _connection(conn) as conn:
+            return conn.execute(SQL_PENDING_PAYMENTS, (transaction_id,)).fetchall()
     
     @staticmethod
-    def get_by_user(user_id):
-        """Get all payments by a user"""
-        conn = get_db_connection()
-        payments = conn.execute(
-            '''SELECT p.*, c.title as course_title
-               FROM payments p
-               JOIN courses c ON p.course_id = c.id
-               WHERE p.user_id = ?
-               ORDER BY p.payment_date DESC''',
-            (user_id,)
-        ).fetchall()
-        conn.close()
-        return payments
+    def update_status_by_transaction(transaction_id, status, conn=None):
+        """Update the status of the payment(s) recorded under a gateway transaction id"""
+        with _connection(conn) as conn:
+            conn.execute(SQL_SET_STATUS_BY_TRANSACTION, (status, transaction_id))
     
     @staticmethod
-    def get_by_transaction_id(transaction_id):
-        """Get payment by transaction ID"""
-        conn = get_db_connection()
-        payment = conn.execute('SELECT * FROM payments WHERE transaction_id = ?', (transaction_id,)).fetchone()
-        conn.close()
-        return payment
+    def get_by_user(user_id, limit=None, offset=0):
+        """Get a user's payments, newest first (optionally one `limit`-sized page)"""
+        with borrow() as conn:
+            # LIMIT -1 means no limit in SQLite
+            return conn.execute(
+                '''SELECT p.*, c.title as course_title
+                   FROM payments p
+                   JOIN courses c ON p.course_id = c.id
+                   WHERE p.user_id = ?
+                   ORDER BY p.payment_date DESC, p.id DESC
+                   LIMIT ? OFFSET ?''',
+                (user_id, -1 if limit is None else limit, offset)
+            ).fetchall()
     
     @staticmethod
-    def get_total_revenue():
-        """Get total revenue from successful payments"""
-        conn = get_db_connection()
-        result = conn.execute("SELECT SUM(amount) FROM payments WHERE status = 'success'").fetchone()
-        conn.close()
-        return result[0] if result[0] else 0
+    def get_by_transaction_id(transaction_id):
+        """Get payment by transaction ID"""
+        with borrow() as conn:
+            return conn.execute('SELECT * FROM payments WHERE transaction_id = ?', (transaction_id,)).fetchone()
+    
+    @staticmethod
+    def get_all(limit=None, offset=0):
+        """Get all payments, newest first (optionally one `limit`-sized page); idx_payments_date serves the order"""
+        with borrow() as conn:
+            return _fetch_as(
+                conn, PaymentRecord,
+                '''SELECT p.id, p.user_id, p.course_id, p.amount, p.transaction_id, p.status,
+                          p.payment_date, u.username, c.title as course_title
+                   FROM payments p
+                   JOIN users u ON p.user_id = u.id
+                   JOIN courses c ON p.course_id = c.id
+                   ORDER BY p.payment_date DESC, p.id DESC
+                   LIMIT ? OFFSET ?''',
+                (-1 if limit is None else limit, offset)
+            )
     
     @staticmethod
-    def get_all():
-        """Get all payments"""
-        conn = get_db_connection()
-        payments = conn.execute(
-            '''SELECT p.*, u.username, c.title as course_title
-               FROM payments p
-               JOIN users u ON p.user_id = u.id
-               JOIN courses c ON p.course_id = c.id
-               ORDER BY p.payment_date DESC'''
-        ).fetchall()
-        conn.close()
-        return payments
+    def iter_all():
+        """Yield every payment row by row, for exports that shouldn't hold the whole table"""
+        with borrow() as conn:
+            yield from conn.execute(
+                '''SELECT p.id, p.payment_date, u.username, u.email, c.title as course_title,
+                          p.amount, p.status, p.transaction_id
+                   FROM payments p
+                   JOIN users u ON p.user_id = u.id
+                   JOIN courses c ON p.course_id = c.id
+                   ORDER BY p.payment_date DESC'''
+            )
 
 class Cart:
     """Cart model for shopping cart functionality"""
@@ -503,62 +852,70 @@ class Cart:
     @staticmethod
     def add_item(user_id, course_id):
         """Add course to cart"""
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                'INSERT INTO cart (user_id, course_id) VALUES (?, ?)',
-                (user_id, course_id)
+        with borrow() as conn:
+            # Copy the current price so the cart total needs no join
+            return _insert(
+                conn,
+                '''INSERT INTO cart (user_id, course_id, price_at_add) SELECT ?, ?, price FROM courses WHERE id = ?
+                   ON CONFLICT (user_id, course_id) DO NOTHING''',
+                (user_id, course_id, course_id)
             )
-            conn.commit()
-            cart_id = cursor.lastrowid
-            conn.close()
-            return cart_id
-        except sqlite3.IntegrityError:
-            conn.close()
-            return None
     
     @staticmethod
     def remove_item(user_id, course_id):
         """Remove course from cart"""
-        conn = get_db_connection()
-        conn.execute('DELETE FROM cart WHERE user_id = ? AND course_id = ?', (user_id, course_id))
-        conn.commit()
-        conn.close()
+        with borrow() as conn:
+            conn.execute('DELETE FROM cart WHERE user_id = ? AND course_id = ?', (user_id, course_id))
+    
+    @staticmethod
+    def remove_items(items, conn=None):
+        """Remove (user_id, course_id) items from carts in one transaction"""
+        if conn is None:
+            with transaction() as conn:
+                return Cart.remove_items(items, conn)
+        conn.executemany('DELETE FROM cart WHERE user_id = ? AND course_id = ?', items)
+    
+    @staticmethod
+    def contains(user_id, course_id):
+        """Check if a course is in the user's cart"""
+        with borrow() as conn:
+            return conn.execute(SQL_IN_CART, (user_id, course_id)).fetchone() is not None
     
     @staticmethod
     def get_items(user_id):
         """Get all items in user's cart"""
-        conn = get_db_connection()
-        items = conn.execute(
-            '''SELECT c.*, co.title, co.description, co.price, co.thumbnail, co.category
-               FROM cart c
-               JOIN courses co ON c.course_id = co.id
-               WHERE c.user_id = ?
-               ORDER BY c.added_at DESC''',
-            (user_id,)
-        ).fetchall()
-        conn.close()
-        return items
+        with borrow() as conn:
+            return conn.execute(
+                '''SELECT c.*, co.title, co.description, co.price, co.thumbnail, co.category
+                   FROM cart c
+                   JOIN courses co ON c.course_id = co.id
+                   WHERE c.user_id = ?
+                   ORDER BY c.added_at DESC''',
+                (user_id,)
+            ).fetchall()
     
     @staticmethod
     def clear_cart(user_id):
         """Clear all items from user's cart"""
-        conn = get_db_connection()
-        conn.execute('DELETE FROM cart WHERE user_id = ?', (user_id,))
-        conn.commit()
-        conn.close()
+        with borrow() as conn:
+            conn.execute('DELETE FROM cart WHERE user_id = ?', (user_id,))
     
     @staticmethod
-    def get_cart_total(user_id):
-        """Get total price of items in cart"""
-        conn = get_db_connection()
-        result = conn.execute(
-            '''SELECT SUM(co.price)
-               FROM cart c
-               JOIN courses co ON c.course_id = co.id
-               WHERE c.user_id = ?''',
-            (user_id,)
-        ).fetchone()
-        conn.close()
-        return result[0] if result[0] else 0
+    def total(cart_items):
+        """Total price of rows from get_items(), summed without another query"""
+        return sum(item['price_at_add'] or 0 for item in cart_items)
+
+class Stats:
+    """Site-wide counters for the admin pages"""
+    
+    @staticmethod
+    def dashboard_stats(conn=None):
+        """Get student, enrollment, revenue and course totals in one query"""
+        with _connection(conn) as conn:
+            row = conn.execute(
+                '''SELECT (SELECT COUNT(*) FROM users WHERE is_admin = 0) AS students,
+                          (SELECT COUNT(*) FROM enrollments) AS enrollments,
+                          (SELECT COALESCE(SUM(amount), 0) FROM payments WHERE status = 'success') AS revenue,
+                          (SELECT COUNT(*) FROM courses) AS courses'''
+            ).fetchone()
+        return dict(row)
@@ -1,15 +1,75 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, Response, stream_with_context, current_app
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
-from models import User, Course, Content, Enrollment, Payment, get_db_connection
+from models import User, Course, Content, Enrollment, Payment, Stats, borrow
 from forms import CourseForm, ContentUploadForm
 import os
+import csv
+import io
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import unquote
 from config import Config
 from functools import wraps
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
 
+# Report queries for the dashboard and analytics pages
+
+# Counting per course off idx_enrollments_course first avoids grouping the whole join
+SQL_POPULAR_COURSES = '''
+    SELECT c.id, c.title, COALESCE(e.enrollment_count, 0) as enrollment_count
+    FROM courses c
+    LEFT JOIN (SELECT course_id, COUNT(*) as enrollment_count
+               FROM enrollments GROUP BY course_id) e ON c.id = e.course_id
+    ORDER BY enrollment_count DESC
+    LIMIT 5
+'''
+
+# Enrollments and payments are aggregated per course before joining, so the two
+# don't multiply each other's rows (which also inflated revenue)
+SQL_COURSE_STATS = '''
+    SELECT
+        c.id,
+        c.title,
+        c.category,
+        c.price,
+        COALESCE(e.enrollment_count, 0) as enrollment_count,
+        COALESCE(p.revenue, 0) as revenue
+    FROM courses c
+    LEFT JOIN (SELECT course_id, COUNT(*) as enrollment_count
+               FROM enrollments GROUP BY course_id) e ON c.id = e.course_id
+    LEFT JOIN (SELECT course_id, SUM(amount) as revenue
+               FROM payments WHERE status = 'success' GROUP BY course_id) p ON c.id = p.course_id
+    ORDER BY enrollment_count DESC
+'''
+
+SQL_CATEGORY_STATS = '''
+    SELECT
+        c.category,
+        COUNT(*) as course_count,
+        COALESCE(SUM(e.enrollment_count), 0) as enrollment_count
+    FROM courses c
+    LEFT JOIN (SELECT course_id, COUNT(*) as enrollment_count
+               FROM enrollments GROUP BY course_id) e ON c.id = e.course_id
+    GROUP BY c.category
+    ORDER BY enrollment_count DESC
+'''
+
+SQL_RECENT_PAYMENTS = '''
+    SELECT p.*, u.username, c.title as course_title
+    FROM payments p
+    JOIN users u ON p.user_id = u.id
+    JOIN courses c ON p.course_id = c.id
+    ORDER BY p.payment_date DESC
+    LIMIT 10
+'''
+
+
 def admin_required(f):
     """Decorator to require admin access"""
 
@@ -25,7 +85,102 @@ def admin_required(f):
 
 def allowed_file(filename, allowed_extensions):
     """Check if file has an allowed extension"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
+    # Only the suffix after the last dot matters
+    i = filename.rfind('.')
+    return i >= 0 and filename[i + 1:].lower() in allowed_extensions
+
+
+def remove_upload(path, logger):
+    """Delete an uploaded file, logging (not raising) failures; a missing file is fine"""
+    try:
+        Path(path).unlink(missing_ok=True)
+    except OSError as e:
+        logger.warning(f"Error deleting file {path}: {e}")
+
+
+# Allowed extensions and upload subdirectory for each content type
+CONTENT_UPLOAD_TARGETS = {
+    'video': (Config.ALLOWED_VIDEO_EXTENSIONS, 'videos'),
+    'pdf': (Config.ALLOWED_DOCUMENT_EXTENSIONS, 'notes'),
+    'presentation': (Config.ALLOWED_PRESENTATION_EXTENSIONS, 'presentations'),
+}
+
+
+def upload_timestamp():
+    """Timestamp prefix for stored upload names (same output as strftime('%Y%m%d_%H%M%S'))"""
+    n = datetime.now()
+    return f"{n.year:04d}{n.month:02d}{n.day:02d}_{n.hour:02d}{n.minute:02d}{n.second:02d}"
+
+
+# Upload subdirectories already created by this process
+_ready_upload_dirs = set()
+
+# Mode a plainly created file would get; temp files start out 0600, which would hide uploads from the web server
+_process_umask = os.umask(0)
+os.umask(_process_umask)
+UPLOAD_FILE_MODE = 0o666 & ~_process_umask
+
+
+def upload_path(subdirectory, filename):
+    """Build the stored (relative, absolute) paths for an uploaded file"""
+    filename = f"{upload_timestamp()}_{secure_filename(filename)}"
+
+    # Ensure subdirectory exists (once per process; /tmp on Vercel starts empty)
+    if subdirectory not in _ready_upload_dirs:
+        os.makedirs(os.path.join(Config.UPLOAD_FOLDER, subdirectory), exist_ok=True)
+        _ready_upload_dirs.add(subdirectory)
+
+    file_path = os.path.join(subdirectory, filename)
+    return file_path, os.path.join(Config.UPLOAD_FOLDER, file_path)
+
+
+def store_content_file(stream, subdirectory, filename):
+    """Store an uploaded content file under a name derived from its BLAKE2b hash.
+
+    The file ends up at <subdirectory>/<first two hex digits>/<digest><ext>, so
+    identical uploads share one file on disk. Returns the relative path.
+    """
+    ext = os.path.splitext(secure_filename(filename))[1].lower()
+    upload_dir = os.path.join(Config.UPLOAD_FOLDER, subdirectory)
+    if subdirectory not in _ready_upload_dirs:
+        os.makedirs(upload_dir, exist_ok=True)
+        _ready_upload_dirs.add(subdirectory)
+
+    # Hash while copying into a temp file next to the final location, so the rename is atomic
+    digest = hashlib.blake2b(digest_size=32)
+    with tempfile.NamedTemporaryFile(dir=upload_dir, suffix='.part', delete=False) as tmp:
+        try:
+            while chunk := stream.read(Config.UPLOAD_BUFFER_SIZE):
+                digest.update(chunk)
+                tmp.write(chunk)
+            os.fchmod(tmp.fileno(), UPLOAD_FILE_MODE)
+        except BaseException:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+
+    name = digest.hexdigest()
+    file_path = os.path.join(subdirectory, name[:2], name + ext)
+    full_path = os.path.join(Config.UPLOAD_FOLDER, file_path)
+    if os.path.exists(full_path):
+        # Same bytes already stored: keep the existing file
+        os.remove(tmp.name)
+    else:
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        os.replace(tmp.name, full_path)
+    return file_path
+
+
+def remove_unused_uploads(file_paths):
+    """Delete stored content files that no content row references any more"""
+    paths = [os.path.join(Config.UPLOAD_FOLDER, file_path) for file_path in Content.unreferenced(file_paths)]
+    if len(paths) > 1:
+        # In parallel so the request waits ~one unlink, not all of them
+        logger = current_app.logger
+        with ThreadPoolExecutor(max_workers=min(8, len(paths))) as executor:
+            list(executor.map(lambda path: remove_upload(path, logger), paths))
+    elif paths:
+        remove_upload(paths[0], current_app.logger)
 
 
 @admin_bp.route('/dashboard')
@@ -34,31 +189,20 @@ def allowed_file(filename, allowed_extensions):
 def dashboard():
     """Admin dashboard with statistics"""
     # Get statistics
-    total_students = User.get_student_count()
-    total_enrollments = Enrollment.get_enrollment_count()
-    total_revenue = Payment.get_total_revenue()
-    total_courses = len(Course.get_all())
+    stats = Stats.dashboard_stats()
 
     # Get recent enrollments
     recent_enrollments = Enrollment.get_recent_enrollments(5)
 
     # Get popular courses (courses with most enrollments)
-    conn = get_db_connection()
-    popular_courses = conn.execute('''
-        SELECT c.id, c.title, COUNT(e.id) as enrollment_count
-        FROM courses c
-        LEFT JOIN enrollments e ON c.id = e.course_id
-        GROUP BY c.id
-        ORDER BY enrollment_count DESC
-        LIMIT 5
-    ''').fetchall()
-    conn.close()
+    with borrow() as conn:
+        popular_courses = conn.execute(SQL_POPULAR_COURSES).fetchall()
 
     return render_template('admin/dashboard.html',
-                           total_students=total_students,
-                           total_enrollments=total_enrollments,
-                           total_revenue=total_revenue,
-                           total_courses=total_courses,
+                           total_students=stats['students'],
+                           total_enrollments=stats['enrollments'],
+                           total_revenue=stats['revenue'],
+                           total_courses=stats['courses'],
                            recent_enrollments=recent_enrollments,
                            popular_courses=popular_courses)
 
@@ -68,18 +212,8 @@ def dashboard():
 @admin_required
 def students():
     """View all registered students"""
-    all_students = User.get_all_students()
-
-    # Get enrollment count for each student
-    students_with_enrollments = []
-    for student in all_students:
-        enrollments = Enrollment.get_by_user(student['id'])
-        students_with_enrollments.append({
-            'student': student,
-            'enrollment_count': len(enrollments)
-        })
-
-    return render_template('admin/students.html', students=students_with_enrollments)
+    all_students = User.get_students_with_enrollment_counts()
+    return render_template('admin/students.html', students=all_students)
 
 
 @admin_bp.route('/student/<int:student_id>')
@@ -123,18 +257,9 @@ def create_course():
         if form.thumbnail.data:
             thumbnail = form.thumbnail.data
             if allowed_file(thumbnail.filename, Config.ALLOWED_IMAGE_EXTENSIONS):
-                filename = secure_filename(thumbnail.filename)
-                # Add timestamp to filename to avoid conflicts
-                from datetime import datetime
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                filename = f"{timestamp}_{filename}"
-
-                # Ensure images directory exists
-                images_dir = os.path.join(Config.UPLOAD_FOLDER, 'images')
-                os.makedirs(images_dir, exist_ok=True)
-
-                thumbnail_path = os.path.join('images', filename)
-                thumbnail.save(os.path.join(Config.UPLOAD_FOLDER, thumbnail_path))
+                # Timestamped name avoids conflicts
+                thumbnail_path, full_path = upload_path('images', thumbnail.filename)
+                thumbnail.save(full_path)
             else:
                 flash('Invalid image format. Please use jpg, jpeg, png, gif, or webp.', 'danger')
                 return render_template('admin/course_form.html', form=form, action='Create')
@@ -176,16 +301,9 @@ def edit_course(course_id):
         if form.thumbnail.data:
             thumbnail = form.thumbnail.data
             if allowed_file(thumbnail.filename, Config.ALLOWED_IMAGE_EXTENSIONS):
-                filename = secure_filename(thumbnail.filename)
-                from datetime import datetime
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                filename = f"{timestamp}_{filename}"
-
-                images_dir = os.path.join(Config.UPLOAD_FOLDER, 'images')
-                os.makedirs(images_dir, exist_ok=True)
-
-                thumbnail_path = os.path.join('images', filename)
-                thumbnail.save(os.path.join(Config.UPLOAD_FOLDER, thumbnail_path))
+                # Timestamped name avoids conflicts
+                thumbnail_path, full_path = upload_path('images', thumbnail.filename)
+                thumbnail.save(full_path)
             else:
                 flash('Invalid image format.', 'danger')
                 return render_template('admin/course_form.html', form=form, action='Edit', course=course)
@@ -218,24 +336,14 @@ def edit_course(course_id):
 @admin_required
 def delete_course(course_id):
     """Delete a course"""
-    course = Course.get_by_id(course_id)
-    if not course:
+    # Delete the course and its content rows; this hands back the content file paths
+    file_paths = Course.delete(course_id)
+    if file_paths is None:
         flash('Course not found.', 'danger')
         return redirect(url_for('admin.manage_courses'))
 
-    # Delete associated content files
-    contents = Content.get_by_course(course_id)
-    for content in contents:
-        file_path = os.path.join(Config.UPLOAD_FOLDER, content['file_path'])
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except OSError as e:
-                import logging
-                logging.error(f"Error deleting file {file_path}: {e}")
-
-    # Delete course (cascade will delete content, enrollments, etc.)
-    Course.delete(course_id)
+    # Delete associated content files (unless other content shares them)
+    remove_unused_uploads(file_paths)
 
     flash('Course deleted successfully!', 'success')
     return redirect(url_for('admin.manage_courses'))
@@ -249,10 +357,9 @@ def upload_content():
     form = ContentUploadForm()
 
     # Populate course choices
-    courses = Course.get_all()
-    form.course_id.choices = [(c['id'], c['title']) for c in courses]
+    form.course_id.choices = Course.get_id_title_pairs()
 
-    if not courses:
+    if not form.course_id.choices:
         flash('Please create a course first before uploading content.', 'warning')
         return redirect(url_for('admin.create_course'))
 
@@ -261,40 +368,19 @@ def upload_content():
         content_type = form.content_type.data
 
         # Determine allowed extensions and subdirectory based on content type
-        if content_type == 'video':
-            allowed_extensions = Config.ALLOWED_VIDEO_EXTENSIONS
-            subdirectory = 'videos'
-        elif content_type == 'pdf':
-            allowed_extensions = Config.ALLOWED_DOCUMENT_EXTENSIONS
-            subdirectory = 'notes'
-        elif content_type == 'presentation':
-            allowed_extensions = Config.ALLOWED_PRESENTATION_EXTENSIONS
-            subdirectory = 'presentations'
-        else:
+        if content_type not in CONTENT_UPLOAD_TARGETS:
             flash('Invalid content type.', 'danger')
             return render_template('admin/upload_content.html', form=form)
+        allowed_extensions, subdirectory = CONTENT_UPLOAD_TARGETS[content_type]
 
         # Validate file extension
         if not allowed_file(file.filename, allowed_extensions):
             flash(f'Invalid file format for {content_type}. Allowed: {", ".join(allowed_extensions)}', 'danger')
             return render_template('admin/upload_content.html', form=form)
 
-        # Secure filename and save
-        filename = secure_filename(file.filename)
-        from datetime import datetime
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"{timestamp}_{filename}"
-
-        # Ensure subdirectory exists
-        upload_dir = os.path.join(Config.UPLOAD_FOLDER, subdirectory)
-        os.makedirs(upload_dir, exist_ok=True)
-
-        file_path = os.path.join(subdirectory, filename)
-        full_path = os.path.join(Config.UPLOAD_FOLDER, file_path)
-
-        # Save file
+        # Save file under its content hash
         try:
-            file.save(full_path)
+            file_path = store_content_file(file.stream, subdirectory, file.filename)
         except Exception as e:
             flash(f'Error uploading file: {str(e)}', 'danger')
             return render_template('admin/upload_content.html', form=form)
@@ -312,11 +398,64 @@ def upload_content():
             flash(f'{content_type.capitalize()} uploaded successfully!', 'success')
             return redirect(url_for('admin.upload_content'))
         else:
+            # Don't leave the stored file behind if nothing else references it
+            remove_unused_uploads([file_path])
             flash('Failed to create content record.', 'danger')
 
     return render_template('admin/upload_content.html', form=form)
 
 
+@admin_bp.route('/upload-content/stream', methods=['POST'])
+@login_required
+@admin_required
+def upload_content_stream():
+    """Upload course content sent as a raw request body (used for large videos)
+
+    Metadata comes in X-Course-Id, X-Title, X-Content-Type, X-Display-Order and
+    X-Filename (URL-encoded) headers. The body is copied straight to disk
+    instead of going through the multipart form parser.
+    """
+    headers = request.headers
+    content_type = headers.get('X-Content-Type', '')
+    filename = unquote(headers.get('X-Filename', ''))
+    title = unquote(headers.get('X-Title', '')).strip()
+    course_id = headers.get('X-Course-Id', type=int)
+    display_order = headers.get('X-Display-Order', 0, type=int)
+
+    if content_type not in CONTENT_UPLOAD_TARGETS:
+        return {'success': False, 'message': 'Invalid content type.'}, 400
+    allowed_extensions, subdirectory = CONTENT_UPLOAD_TARGETS[content_type]
+
+    if course_id is None or not Course.get_by_id(course_id):
+        return {'success': False, 'message': 'Course not found.'}, 400
+    if not 3 <= len(title) <= 200:
+        return {'success': False, 'message': 'Title must be between 3 and 200 characters'}, 400
+    if display_order is None or display_order < 0:
+        return {'success': False, 'message': 'Order must be a positive number'}, 400
+    if not allowed_file(filename, allowed_extensions):
+        return {'success': False,
+                'message': f'Invalid file format for {content_type}. Allowed: {", ".join(allowed_extensions)}'}, 400
+
+    try:
+        file_path = store_content_file(request.stream, subdirectory, filename)
+    except Exception as e:
+        return {'success': False, 'message': f'Error uploading file: {str(e)}'}, 500
+
+    content_id = Content.create(
+        course_id=course_id,
+        title=title,
+        content_type=content_type,
+        file_path=file_path,
+        display_order=display_order
+    )
+    if not content_id:
+        remove_unused_uploads([file_path])
+        return {'success': False, 'message': 'Failed to create content record.'}, 500
+
+    flash(f'{content_type.capitalize()} uploaded successfully!', 'success')
+    return {'success': True, 'content_id': content_id}
+
+
 @admin_bp.route('/course/<int:course_id>/contents')
 @login_required
 @admin_required
@@ -337,24 +476,15 @@ def course_contents(course_id):
 @admin_required
 def delete_content(content_id):
     """Delete course content"""
-    content = Content.get_by_id(content_id)
+    content = Content.delete(content_id)
     if not content:
         flash('Content not found.', 'danger')
         return redirect(url_for('admin.manage_courses'))
 
     course_id = content['course_id']
 
-    # Delete file
-    file_path = os.path.join(Config.UPLOAD_FOLDER, content['file_path'])
-    if os.path.exists(file_path):
-        try:
-            os.remove(file_path)
-        except OSError as e:
-            import logging
-            logging.error(f"Error deleting file {file_path}: {e}")
-
-    # Delete content record
-    Content.delete(content_id)
+    # Delete file (unless other content shares it)
+    remove_unused_uploads([content['file_path']])
 
     flash('Content deleted successfully!', 'success')
     return redirect(url_for('admin.course_contents', course_id=course_id))
@@ -366,59 +496,46 @@ def delete_content(content_id):
 def analytics():
     """View analytics and statistics"""
     # Get comprehensive statistics
-    conn = get_db_connection()
-
-    # Course statistics
-    course_stats = conn.execute('''
-        SELECT 
-            c.id,
-            c.title,
-            c.category,
-            c.price,
-            COUNT(DISTINCT e.id) as enrollment_count,
-            COALESCE(SUM(CASE WHEN p.status = 'success' THEN p.amount ELSE 0 END), 0) as revenue
-        FROM courses c
-        LEFT JOIN enrollments e ON c.id = e.course_id
-        LEFT JOIN payments p ON c.id = p.course_id
-        GROUP BY c.id
-        ORDER BY enrollment_count DESC
-    ''').fetchall()
-
-    # Category statistics
-    category_stats = conn.execute('''
-        SELECT 
-            c.category,
-            COUNT(DISTINCT c.id) as course_count,
-            COUNT(DISTINCT e.id) as enrollment_count
-        FROM courses c
-        LEFT JOIN enrollments e ON c.id = e.course_id
-        GROUP BY c.category
-        ORDER BY enrollment_count DESC
-    ''').fetchall()
-
-    # Recent payments
-    recent_payments = conn.execute('''
-        SELECT p.*, u.username, c.title as course_title
-        FROM payments p
-        JOIN users u ON p.user_id = u.id
-        JOIN courses c ON p.course_id = c.id
-        ORDER BY p.payment_date DESC
-        LIMIT 10
-    ''').fetchall()
-
-    conn.close()
-
-    # General statistics
-    total_students = User.get_student_count()
-    total_enrollments = Enrollment.get_enrollment_count()
-    total_revenue = Payment.get_total_revenue()
-    total_courses = len(Course.get_all())
+    with borrow() as conn:
+        # Course statistics
+        course_stats = conn.execute(SQL_COURSE_STATS).fetchall()
+
+        # Category statistics
+        category_stats = conn.execute(SQL_CATEGORY_STATS).fetchall()
+
+        # Recent payments
+        recent_payments = conn.execute(SQL_RECENT_PAYMENTS).fetchall()
+
+        # General statistics, on the same connection
+        stats = Stats.dashboard_stats(conn=conn)
 
     return render_template('admin/analytics.html',
-                           total_students=total_students,
-                           total_enrollments=total_enrollments,
-                           total_revenue=total_revenue,
-                           total_courses=total_courses,
+                           total_students=stats['students'],
+                           total_enrollments=stats['enrollments'],
+                           total_revenue=stats['revenue'],
+                           total_courses=stats['courses'],
                            course_stats=course_stats,
                            category_stats=category_stats,
                            recent_payments=recent_payments)
+
+
+@admin_bp.route('/payments/export.csv')
+@login_required
+@admin_required
+def export_payments():
+    """Download all payments as CSV, streamed as rows are read"""
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['ID', 'Date', 'Student', 'Email', 'Course', 'Amount', 'Status', 'Transaction ID'])
+        for payment in Payment.iter_all():
+            writer.writerow(payment)
+            # Flush every row so memory stays flat however many payments there are
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=payments.csv'})
@@ -1,8 +1,7 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.security import check_password_hash, generate_password_hash
 from forms import RegistrationForm, LoginForm, ProfileUpdateForm, PasswordChangeForm
-from models import User, get_db_connection
+from models import User
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
@@ -14,16 +13,7 @@ def register():
     
     form = RegistrationForm()
     if form.validate_on_submit():
-        # Check if user already exists
-        if User.get_by_email(form.email.data):
-            flash('Email already registered. Please use a different email.', 'danger')
-            return render_template('auth/register.html', form=form)
-        
-        if User.get_by_username(form.username.data):
-            flash('Username already taken. Please choose a different username.', 'danger')
-            return render_template('auth/register.html', form=form)
-        
-        # Create new user
+        # Create new user; the UNIQUE constraints reject an existing email or username
         user_id = User.create(
             username=form.username.data,
             email=form.email.data,
@@ -33,6 +23,13 @@ def register():
         if user_id:
             flash('Registration successful! Please log in.', 'success')
             return redirect(url_for('auth.login'))
+        
+        # Only look up which field clashed once the insert has been refused
+        email_taken, username_taken = User.find_taken(form.username.data, form.email.data)
+        if email_taken:
+            flash('Email already registered. Please use a different email.', 'danger')
+        elif username_taken:
+            flash('Username already taken. Please choose a different username.', 'danger')
         else:
             flash('Registration failed. Please try again.', 'danger')
     
@@ -51,6 +48,9 @@ def login():
         user = User.get_by_email(form.email.data)
         
         if user and user.check_password(form.password.data):
+            # Upgrade hashes made with an older method now that we have the plain password
+            if user.needs_rehash():
+                User.set_password(user.id, form.password.data)
             login_user(user, remember=True)
             
             # Redirect based on user role
@@ -70,6 +70,7 @@ def login():
 @login_required
 def logout():
     """User logout route"""
+    User.invalidate_cache(current_user.id)
     logout_user()
     flash('You have been logged out successfully.', 'info')
     return redirect(url_for('index'))
@@ -87,27 +88,19 @@ def profile():
         profile_form.email.data = current_user.email
     
     if profile_form.validate_on_submit() and 'update_profile' in request.form:
-        # Check if username is taken by another user
-        existing_user = User.get_by_username(profile_form.username.data)
-        if existing_user and existing_user.id != current_user.id:
-            flash('Username already taken by another user.', 'danger')
-            return render_template('auth/profile.html', profile_form=profile_form, password_form=password_form)
-        
-        # Check if email is taken by another user
-        existing_user = User.get_by_email(profile_form.email.data)
-        if existing_user and existing_user.id != current_user.id:
-            flash('Email already registered to another user.', 'danger')
+        # Update user profile; the UNIQUE constraints reject another user's username or email
+        if not User.update_profile(current_user.id, profile_form.username.data, profile_form.email.data):
+            email_taken, username_taken = User.find_taken(
+                profile_form.username.data, profile_form.email.data, exclude_id=current_user.id
+            )
+            if username_taken:
+                flash('Username already taken by another user.', 'danger')
+            elif email_taken:
+                flash('Email already registered to another user.', 'danger')
+            else:
+                flash('Profile update failed. Please try again.', 'danger')
             return render_template('auth/profile.html', profile_form=profile_form, password_form=password_form)
         
-        # Update user profile
-        conn = get_db_connection()
-        conn.execute(
-            'UPDATE users SET username = ?, email = ? WHERE id = ?',
-            (profile_form.username.data, profile_form.email.data, current_user.id)
-        )
-        conn.commit()
-        conn.close()
-        
         flash('Profile updated successfully!', 'success')
         return redirect(url_for('auth.profile'))
     
@@ -117,15 +110,13 @@ def profile():
             flash('Current password is incorrect.', 'danger')
             return render_template('auth/profile.html', profile_form=profile_form, password_form=password_form)
         
+        # The current password was just verified, so a plain comparison spares re-hashing the same one
+        if password_form.new_password.data == password_form.current_password.data:
+            flash('New password must differ from the current password.', 'warning')
+            return render_template('auth/profile.html', profile_form=profile_form, password_form=password_form)
+        
         # Update password
-        new_password_hash = generate_password_hash(password_form.new_password.data)
-        conn = get_db_connection()
-        conn.execute(
-            'UPDATE users SET password_hash = ? WHERE id = ?',
-            (new_password_hash, current_user.id)
-        )
-        conn.commit()
-        conn.close()
+        User.set_password(current_user.id, password_form.new_password.data)
         
         flash('Password changed successfully!', 'success')
         return redirect(url_for('auth.profile'))
@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request
 from models import Course
 from forms import SearchForm
+from config import Config
 
 courses_bp = Blueprint('courses', __name__, url_prefix='/courses')
 
@@ -13,15 +14,14 @@ def index():
     search_query = request.args.get('query', '').strip()
     category_filter = request.args.get('category', '').strip()
     
-    # Fetch courses based on filters
-    if search_query:
-        courses = Course.search(search_query)
-    elif category_filter:
-        courses = Course.get_by_category(category_filter)
-    else:
-        courses = Course.get_all()
+    page = max(request.args.get('page', 1, type=int), 1)
     
-    return render_template('courses/index.html', courses=courses, form=form)
+    # Fetch one extra row to tell whether there is a next page
+    per_page = Config.COURSES_PER_PAGE
+    courses = Course.filter(search_query, category_filter, limit=per_page + 1, offset=(page - 1) * per_page)
+    
+    return render_template('courses/index.html', courses=courses[:per_page], form=form,
+                           page=page, has_next=len(courses) > per_page)
 
 @courses_bp.route('/<int:course_id>')
 def detail(course_id):
@@ -35,7 +35,10 @@ def detail(course_id):
 @courses_bp.route('/category/<category>')
 def by_category(category):
     """Filter courses by category"""
-    courses = Course.get_by_category(category)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = Config.COURSES_PER_PAGE
+    courses = Course.filter(category=category, limit=per_page + 1, offset=(page - 1) * per_page)
     form = SearchForm()
     
-    return render_template('courses/index.html', courses=courses, form=form, selected_category=category)
+    return render_template('courses/index.html', courses=courses[:per_page], form=form, selected_category=category,
+                           page=page, has_next=len(courses) > per_page)
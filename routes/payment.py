@@ -1,24 +1,54 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_required, current_user
-from models import Course, Payment, Enrollment, Cart, get_db_connection
+from models import Course, Payment, Enrollment, Cart, transaction
 from config import Config
 import hashlib
-import uuid
+import re
+import secrets
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 payment_bp = Blueprint('payment', __name__, url_prefix='/payment')
 
+# Purchase endpoints admins are turned away from; history and the eSewa callbacks stay open
+PURCHASE_ENDPOINTS = frozenset(('payment.initiate_payment', 'payment.initiate_cart_payment'))
+
+@payment_bp.before_request
+def block_admin_purchases():
+    """Turn admins away from purchase endpoints with one check per request"""
+    if request.endpoint in PURCHASE_ENDPOINTS and current_user.is_authenticated and current_user.is_admin:
+        flash('Admin users cannot make purchases.', 'warning')
+        return redirect(url_for('admin.dashboard'))
+
+# One keep-alive session for eSewa verification calls, so callbacks after the first skip the TCP/TLS handshake.
+# POSTs are only retried when the connection could not be made, never after eSewa received the request.
+_esewa_session = requests.Session()
+_esewa_session.mount('https://', HTTPAdapter(
+    pool_connections=4, pool_maxsize=16, max_retries=Retry(total=2, backoff_factor=0.2)
+))
+
 def generate_transaction_id():
     """Generate a unique transaction ID"""
-    return str(uuid.uuid4())
+    # 128 random bits, hex-encoded so the id stays plain alphanumeric for eSewa's pid field
+    return secrets.token_hex(16)
+
+def amount_matches(payments, amt):
+    """Check a gateway-reported amount against the total of the payment rows it claims to settle"""
+    try:
+        paid = float(amt)
+    except (TypeError, ValueError):
+        return False
+    return bool(payments) and round(paid, 2) == round(sum(payment['amount'] for payment in payments), 2)
 
 def verify_esewa_signature(params):
     """
     Verify eSewa payment signature for security
     
-    IMPORTANT: In production, this must verify the payment with eSewa's server
-    by making an API call to their verification endpoint with the transaction details.
+    Confirms the transaction with eSewa's verification endpoint (Config.ESEWA_VERIFY_URL).
     
-    For development/testing, this performs basic validation only.
+    IMPORTANT: With no verification endpoint configured (development/testing), this performs
+    basic validation only. ESEWA_VERIFY_URL MUST be set in production.
     """
     # Check required parameters are present
     required_params = ['oid', 'amt', 'refId']
@@ -26,24 +56,28 @@ def verify_esewa_signature(params):
         if param not in params:
             return False
     
-    # TODO: In production, implement actual eSewa signature verification
-    # Example:
-    # 1. Construct verification request with transaction details
-    # 2. Make POST request to eSewa verification endpoint
-    # 3. Parse and validate response
-    # 4. Return True only if eSewa confirms the payment
+    if not Config.ESEWA_VERIFY_URL:
+        current_app.logger.warning(f"Payment callback received without server verification for transaction {params['oid']}. "
+                                   "Set ESEWA_VERIFY_URL before production deployment!")
+        return True
+    
+    try:
+        response = _esewa_session.post(
+            Config.ESEWA_VERIFY_URL,
+            data={'amt': params['amt'], 'rid': params['refId'], 'pid': params['oid'], 'scd': Config.ESEWA_MERCHANT_ID},
+            timeout=5
+        )
+    except requests.RequestException as e:
+        current_app.logger.warning(f"eSewa verification request failed for transaction {params['oid']}: {e}")
+        return False
     
-    # For now, return True for development (MUST BE FIXED FOR PRODUCTION)
-    return True
+    # eSewa answers with a small XML document whose response_code is "Success" for a confirmed payment
+    return response.ok and re.search(r'<response_code>\s*success\s*</response_code>', response.text, re.I) is not None
 
 @payment_bp.route('/initiate/<int:course_id>', methods=['POST'])
 @login_required
 def initiate_payment(course_id):
     """Initiate eSewa payment for a single course"""
-    if current_user.is_admin:
-        flash('Admin users cannot make purchases.', 'warning')
-        return redirect(url_for('admin.dashboard'))
-    
     course = Course.get_by_id(course_id)
     if not course:
         flash('Course not found.', 'danger')
@@ -86,30 +120,32 @@ def initiate_payment(course_id):
 @login_required
 def initiate_cart_payment():
     """Initiate eSewa payment for all items in cart"""
-    if current_user.is_admin:
-        flash('Admin users cannot make purchases.', 'warning')
-        return redirect(url_for('admin.dashboard'))
-    
     cart_items = Cart.get_items(current_user.id)
     if not cart_items:
         flash('Your cart is empty.', 'warning')
         return redirect(url_for('student.cart'))
     
-    total_amount = Cart.get_cart_total(current_user.id)
-    
     # Create payment records for each course in cart
     transaction_id = generate_transaction_id()
     
-    for item in cart_items:
-        # Check if already enrolled (shouldn't happen, but safety check)
-        if not Enrollment.is_enrolled(current_user.id, item['course_id']):
-            Payment.create(
-                user_id=current_user.id,
-                course_id=item['course_id'],
-                amount=item['price'],
-                transaction_id=transaction_id,
-                status='pending'
-            )
+    with transaction() as conn:
+        # Skip courses already enrolled in (shouldn't happen, but safety check)
+        enrolled = Enrollment.get_enrolled_course_ids(
+            current_user.id, [item['course_id'] for item in cart_items], conn=conn
+        )
+        cart_items = [item for item in cart_items if item['course_id'] not in enrolled]
+        # Record and charge the same cart price, so the eSewa amount matches the payment rows
+        Payment.create_many(
+            [(current_user.id, item['course_id'], item['price_at_add'], transaction_id, 'pending')
+             for item in cart_items],
+            conn=conn
+        )
+    
+    if not cart_items:
+        flash('You are already enrolled in every course in your cart.', 'info')
+        return redirect(url_for('student.dashboard'))
+    
+    total_amount = Cart.total(cart_items)
     
     # Prepare eSewa payment data
     esewa_data = {
@@ -143,51 +179,23 @@ def payment_success():
         flash('Invalid payment response. Please contact support.', 'danger')
         return redirect(url_for('student.dashboard'))
     
-    # CRITICAL: Verify payment with eSewa server
-    # WARNING: This is a development version. In production, you MUST:
-    # 1. Make a server-to-server call to eSewa verification endpoint
-    # 2. Verify the signature and transaction details
-    # 3. Only process enrollment if eSewa confirms the payment
-    
-    # For development: Add warning log
-    import logging
-    logging.warning(f"Payment callback received without server verification for transaction {oid}. "
-                   "This MUST be implemented before production deployment!")
-    
-    # Verify payment (in production, verify with eSewa server)
-    verification_params = {'oid': oid, 'amt': amt, 'refId': refId}
-    if not verify_esewa_signature(verification_params):
-        flash('Payment verification failed. Please contact support.', 'danger')
-        return redirect(url_for('student.dashboard'))
-    
-    # Update payment status
-    conn = get_db_connection()
-    payments = conn.execute(
-        'SELECT * FROM payments WHERE transaction_id = ? AND status = ?',
-        (oid, 'pending')
-    ).fetchall()
-    
-    if not payments:
-        conn.close()
-        flash('Payment record not found or already processed.', 'warning')
-        return redirect(url_for('student.dashboard'))
-    
-    # Process each payment in the transaction
-    for payment in payments:
-        # Update payment status
-        conn.execute(
-            'UPDATE payments SET status = ?, transaction_id = ? WHERE id = ?',
-            ('success', f"{oid}_{refId}", payment['id'])
-        )
+    # Update payment status, enrollments and cart in one commit
+    with transaction() as conn:
+        payments = Payment.get_pending_by_transaction(oid, conn=conn)
+        if not payments:
+            flash('Payment record not found or already processed.', 'warning')
+            return redirect(url_for('student.dashboard'))
         
-        # Enroll user in course
-        Enrollment.create(payment['user_id'], payment['course_id'])
+        # CRITICAL: The callback's amount must be what we charged, and eSewa must confirm it, before enrolling
+        if not amount_matches(payments, amt) or not verify_esewa_signature({'oid': oid, 'amt': amt, 'refId': refId}):
+            flash('Payment verification failed. Please contact support.', 'danger')
+            return redirect(url_for('student.dashboard'))
         
-        # Remove from cart if exists
-        Cart.remove_item(payment['user_id'], payment['course_id'])
-    
-    conn.commit()
-    conn.close()
+        # Mark every payment paid, enroll the user and empty those cart slots, one batch each
+        purchases = [(payment['user_id'], payment['course_id']) for payment in payments]
+        Payment.update_status_many([payment['id'] for payment in payments], 'success', f"{oid}_{refId}", conn=conn)
+        Enrollment.create_many(purchases, conn=conn)
+        Cart.remove_items(purchases, conn=conn)
     
     flash('Payment successful! You have been enrolled in the course(s).', 'success')
     return redirect(url_for('student.dashboard'))
@@ -201,13 +209,7 @@ def payment_failure():
     
     if pid:
         # Update payment status to failed
-        conn = get_db_connection()
-        conn.execute(
-            'UPDATE payments SET status = ? WHERE transaction_id = ?',
-            ('failed', pid)
-        )
-        conn.commit()
-        conn.close()
+        Payment.update_status_by_transaction(pid, 'failed')
     
     flash('Payment failed or was cancelled. Please try again.', 'danger')
     return redirect(url_for('student.cart'))
@@ -215,8 +217,7 @@ def payment_failure():
 @payment_bp.route('/verify', methods=['POST'])
 def verify_payment():
     """Verify payment with eSewa server (webhook/callback)"""
-    # This endpoint would be used for server-to-server verification
-    # In production, implement proper eSewa payment verification API call
+    # This endpoint is used for server-to-server verification
     
     # Get payment details from eSewa
     data = request.form or request.json
@@ -232,8 +233,9 @@ def verify_payment():
     if not all([amt, rid, pid]):
         return {'success': False, 'message': 'Missing parameters'}, 400
     
-    # In production, verify with eSewa server using their verification API
-    # For now, return success
+    # The amount must match what was charged under this transaction, then eSewa must confirm it
+    if not amount_matches(Payment.get_pending_by_transaction(pid), amt) or not verify_esewa_signature({'oid': pid, 'amt': amt, 'refId': rid}):
+        return {'success': False, 'message': 'Payment verification failed'}, 400
     
     return {'success': True, 'message': 'Payment verified'}
 
@@ -241,11 +243,17 @@ def verify_payment():
 @login_required
 def payment_history():
     """View payment history for current user"""
+    page = max(request.args.get('page', 1, type=int), 1)
+    
+    # Fetch one extra row to tell whether there is a next page
+    per_page = Config.PAYMENTS_PER_PAGE
+    offset = (page - 1) * per_page
     if current_user.is_admin:
         # Admin views all payments
-        payments = Payment.get_all()
+        payments = Payment.get_all(limit=per_page + 1, offset=offset)
     else:
         # Student views their own payments
-        payments = Payment.get_by_user(current_user.id)
+        payments = Payment.get_by_user(current_user.id, limit=per_page + 1, offset=offset)
     
-    return render_template('payment/history.html', payments=payments)
+    return render_template('payment/history.html', payments=payments[:per_page],
+                           page=page, has_next=len(payments) > per_page)
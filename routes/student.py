@@ -1,19 +1,36 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, send_file
+from flask import Blueprint, render_template, redirect, url_for, flash, request, send_file, Response
 from flask_login import login_required, current_user
-from models import Course, Enrollment, Content, Cart, get_db_connection
+from models import Course, Enrollment, Content, Cart, borrow
 from forms import SearchForm
 import os
 from config import Config
 
 student_bp = Blueprint('student', __name__, url_prefix='/student')
 
+# Student-only endpoints; the public catalog and course pages stay open to admins
+STUDENT_ONLY_ENDPOINTS = frozenset((
+    'student.dashboard', 'student.watch_course', 'student.download_content',
+    'student.cart', 'student.add_to_cart', 'student.remove_from_cart',
+))
+STUDENT_ONLY_JSON_ENDPOINTS = frozenset(('student.course_contents_json', 'student.update_progress'))
+
+@student_bp.before_request
+def block_admins():
+    """Turn admins away from student-only endpoints with one check per request"""
+    endpoint = request.endpoint
+    if endpoint not in STUDENT_ONLY_ENDPOINTS and endpoint not in STUDENT_ONLY_JSON_ENDPOINTS:
+        return None
+    # Anonymous users fall through to the view's login_required
+    if current_user.is_authenticated and current_user.is_admin:
+        if endpoint in STUDENT_ONLY_JSON_ENDPOINTS:
+            return {'success': False, 'message': 'Admin cannot access student courses'}, 403
+        flash('Admin users cannot access student pages.', 'warning')
+        return redirect(url_for('admin.dashboard'))
+
 @student_bp.route('/dashboard')
 @login_required
 def dashboard():
     """Student dashboard showing enrolled courses"""
-    if current_user.is_admin:
-        return redirect(url_for('admin.dashboard'))
-    
     enrollments = Enrollment.get_by_user(current_user.id)
     return render_template('student/dashboard.html', enrollments=enrollments)
 
@@ -26,15 +43,14 @@ def courses():
     search_query = request.args.get('query', '').strip()
     category_filter = request.args.get('category', '').strip()
     
-    # Fetch courses based on filters
-    if search_query:
-        courses_list = Course.search(search_query)
-    elif category_filter:
-        courses_list = Course.get_by_category(category_filter)
-    else:
-        courses_list = Course.get_all()
+    page = max(request.args.get('page', 1, type=int), 1)
+    
+    # Fetch one extra row to tell whether there is a next page
+    per_page = Config.COURSES_PER_PAGE
+    courses_list = Course.filter(search_query, category_filter, limit=per_page + 1, offset=(page - 1) * per_page)
     
-    return render_template('student/courses.html', courses=courses_list, form=form)
+    return render_template('student/courses.html', courses=courses_list[:per_page], form=form,
+                           page=page, has_next=len(courses_list) > per_page)
 
 @student_bp.route('/course/<int:course_id>')
 def course_detail(course_id):
@@ -50,9 +66,7 @@ def course_detail(course_id):
     
     if current_user.is_authenticated:
         is_enrolled = Enrollment.is_enrolled(current_user.id, course_id)
-        # Check if course is in cart
-        cart_items = Cart.get_items(current_user.id)
-        in_cart = any(item['course_id'] == course_id for item in cart_items)
+        in_cart = Cart.contains(current_user.id, course_id)
     
     # Get course content preview (first item of each type)
     contents = Content.get_by_course(course_id)
@@ -67,44 +81,42 @@ def course_detail(course_id):
 @login_required
 def watch_course(course_id):
     """Watch course content (videos, view notes, presentations)"""
-    if current_user.is_admin:
-        flash('Admin users cannot access student courses.', 'warning')
-        return redirect(url_for('admin.dashboard'))
-    
-    # Check if user is enrolled
-    if not Enrollment.is_enrolled(current_user.id, course_id):
-        flash('You must enroll in this course to access the content.', 'warning')
-        return redirect(url_for('student.course_detail', course_id=course_id))
-    
-    course = Course.get_by_id(course_id)
-    if not course:
-        flash('Course not found.', 'danger')
-        return redirect(url_for('student.dashboard'))
-    
-    # Get all course content
-    contents = Content.get_by_course(course_id)
-    
-    # Get enrollment details for progress
-    conn = get_db_connection()
-    enrollment = conn.execute(
-        'SELECT * FROM enrollments WHERE user_id = ? AND course_id = ?',
-        (current_user.id, course_id)
-    ).fetchone()
-    conn.close()
+    # One pooled connection serves every lookup; it goes back before the template renders
+    with borrow() as conn:
+        # Check if user is enrolled; the enrollment row also carries their progress
+        enrollment = Enrollment.get(current_user.id, course_id, conn=conn)
+        if not enrollment:
+            flash('You must enroll in this course to access the content.', 'warning')
+            return redirect(url_for('student.course_detail', course_id=course_id))
+        
+        # Course rows usually come from the in-process cache, so no join with content here
+        course = Course.get_by_id(course_id, conn=conn)
+        if not course:
+            flash('Course not found.', 'danger')
+            return redirect(url_for('student.dashboard'))
+        
+        # Get all course content
+        contents = Content.get_by_course(course_id, conn=conn)
     
     return render_template('student/watch_course.html', 
                          course=course, 
                          contents=contents,
                          enrollment=enrollment)
 
+@student_bp.route('/course/<int:course_id>/contents.json')
+@login_required
+def course_contents_json(course_id):
+    """List course content as JSON for enrolled students"""
+    if not Enrollment.is_enrolled(current_user.id, course_id):
+        return {'success': False, 'message': 'Not enrolled'}, 403
+    
+    # SQLite already produced the JSON text, so send it as-is
+    return Response(Content.get_by_course_json(course_id), mimetype='application/json')
+
 @student_bp.route('/download/<int:content_id>')
 @login_required
 def download_content(content_id):
     """Download course content (PDFs, presentations)"""
-    if current_user.is_admin:
-        flash('Admin users cannot download content.', 'warning')
-        return redirect(url_for('admin.dashboard'))
-    
     content = Content.get_by_id(content_id)
     if not content:
         flash('Content not found.', 'danger')
@@ -121,23 +133,24 @@ def download_content(content_id):
         return redirect(url_for('student.watch_course', course_id=content['course_id']))
     
     file_path = os.path.join(Config.UPLOAD_FOLDER, content['file_path'])
-    
-    if not os.path.exists(file_path):
+    # Files are stored under their content hash, so name the download after the lesson instead
+    # (send_file encodes non-ASCII titles for the Content-Disposition header)
+    download_name = content['title'].replace('/', '-') + os.path.splitext(file_path)[1]
+    
+    try:
+        # conditional: ETag/Last-Modified revalidation and Range requests;
+        # with USE_X_SENDFILE the front-end server streams the file instead of this worker
+        return send_file(file_path, as_attachment=True, download_name=download_name, conditional=True, etag=True)
+    except FileNotFoundError:
         flash('File not found on server.', 'danger')
         return redirect(url_for('student.watch_course', course_id=content['course_id']))
-    
-    return send_file(file_path, as_attachment=True)
 
 @student_bp.route('/cart')
 @login_required
 def cart():
     """View shopping cart"""
-    if current_user.is_admin:
-        flash('Admin users cannot use shopping cart.', 'warning')
-        return redirect(url_for('admin.dashboard'))
-    
     cart_items = Cart.get_items(current_user.id)
-    total = Cart.get_cart_total(current_user.id)
+    total = Cart.total(cart_items)
     
     return render_template('student/cart.html', cart_items=cart_items, total=total)
 
@@ -145,10 +158,6 @@ def cart():
 @login_required
 def add_to_cart(course_id):
     """Add course to shopping cart"""
-    if current_user.is_admin:
-        flash('Admin users cannot add courses to cart.', 'warning')
-        return redirect(url_for('admin.dashboard'))
-    
     # Check if course exists
     course = Course.get_by_id(course_id)
     if not course:
@@ -173,10 +182,6 @@ def add_to_cart(course_id):
 @login_required
 def remove_from_cart(course_id):
     """Remove course from shopping cart"""
-    if current_user.is_admin:
-        flash('Admin users cannot use shopping cart.', 'warning')
-        return redirect(url_for('admin.dashboard'))
-    
     Cart.remove_item(current_user.id, course_id)
     flash('Course removed from cart.', 'success')
     return redirect(url_for('student.cart'))
@@ -185,9 +190,6 @@ def remove_from_cart(course_id):
 @login_required
 def update_progress(course_id, progress):
     """Update course progress"""
-    if current_user.is_admin:
-        return {'success': False, 'message': 'Admin cannot update progress'}, 403
-    
     if not Enrollment.is_enrolled(current_user.id, course_id):
         return {'success': False, 'message': 'Not enrolled'}, 403
     